@@ -0,0 +1,116 @@
+# -*- Mode: python; coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+#
+# Copyright (C) 2015 - 2016 David Mohammed
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    least-recently-used cache holding a bounded number of items and,
+    optionally, a bounded number of bytes
+    """
+
+    def __init__(self, max_items, max_bytes=0, sizeof=None):
+        """
+        Initialises the object.
+
+        :param max_items: maximum number of items kept before the least
+        recently used are evicted
+        :param max_bytes: maximum total size of the cached values - 0 for
+        no limit
+        :param sizeof: function returning the size in bytes of a value -
+        required when max_bytes is given
+        """
+        super(LRUCache, self).__init__()
+
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._items = OrderedDict()
+        self._sizes = {}
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        return the value cached for key - marking it as recently used
+
+        :param key: hashable key
+        :param default: value returned when the key is not cached
+        :return: cached value or default
+        """
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        cache value for key, evicting the least recently used items if
+        the cache is full
+
+        :param key: hashable key
+        :param value: value to cache
+        """
+        self.remove(key)
+
+        size = 0
+        if self._sizeof:
+            size = self._sizeof(value)
+
+            if self.max_bytes and size > self.max_bytes:
+                # would evict everything else and still not fit
+                return
+
+        self._items[key] = value
+        self._sizes[key] = size
+        self.total_bytes += size
+
+        while len(self._items) > self.max_items or \
+                (self.max_bytes and self.total_bytes > self.max_bytes):
+            old_key, old_value = self._items.popitem(last=False)
+            self.total_bytes -= self._sizes.pop(old_key)
+
+    def remove(self, key):
+        """
+        forget any value cached for key
+        """
+        if key in self._items:
+            del self._items[key]
+            self.total_bytes -= self._sizes.pop(key)
+
+    def clear(self):
+        """
+        forget everything cached
+        """
+        self._items.clear()
+        self._sizes.clear()
+        self.total_bytes = 0
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,500 @@
+# -*- Mode: python; coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+#
+# Copyright (C) 2015 - 2016 David Mohammed
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
+
+import hashlib
+import json
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cairo
+from gi.repository import GLib
+from gi.repository import Gdk
+from gi.repository import GdkPixbuf
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class CoverArtLoader(object):
+    """
+    decodes and scales album-art on a pool of worker threads - finished
+    pixbufs are delivered back to the GTK main loop
+    """
+
+    def __init__(self, workers=2):
+        """
+        Initialises the object.
+
+        :param workers: number of worker threads
+        """
+        super(CoverArtLoader, self).__init__()
+
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._futures = {}  # future: group
+        self._generations = {}  # group: generation
+        self._shutdown = False
+
+    def load(self, filename, pixbuf, sizes, callback, *args, group=None):
+        """
+        decode and scale album-art in the background
+
+        :param filename: filename of the art - decoded directly at the
+        requested size. May be None
+        :param pixbuf: GdkPixbuf to scale when the filename is not given
+        or cannot be decoded. May be None
+        :param sizes: list of (width, height) tuples to render
+        :param callback: function called on the main loop -
+        func(renders, *args) where renders is a dict of (width, height) to
+        GdkPixbuf or None where nothing could be rendered
+        :param group: requests of the same group are abandoned together by
+        cancel
+        :return: concurrent.futures.Future for the request
+        """
+        def rendered(renders, *args):
+            if renders is not None:
+                callback(renders, *args)
+
+        return self._submit(self._render, (filename, pixbuf, sizes),
+                            rendered, args, group)
+
+    def accent_colour(self, pixbuf, callback, *args, group=None):
+        """
+        find the dominant colour of album-art in the background
+
+        :param pixbuf: GdkPixbuf of the album-art - a small render is best
+        :param callback: function called on the main loop -
+        func(colour, *args) where colour is a (red, green, blue) tuple of
+        0-255 values or None if the art has no dominant colour
+        :param group: requests of the same group are abandoned together by
+        cancel
+        :return: concurrent.futures.Future for the request
+        """
+        return self._submit(self._accent_colour, (pixbuf,),
+                            callback, args, group)
+
+    def _submit(self, function, function_args, callback, args, group):
+        """
+        run function(*function_args, is_current) on a worker thread and
+        callback(result, *args) on the main loop unless the group has been
+        cancelled in the meantime
+        """
+        generation = self._generations.get(group, 0)
+
+        def is_current():
+            return not self._shutdown and \
+                self._generations.get(group, 0) == generation
+
+        def deliver(result):
+            if is_current():
+                callback(result, *args)
+            return False
+
+        def done(future):
+            # called from the worker thread
+            self._futures.pop(future, None)
+
+            if future.cancelled() or future.exception() is not None:
+                return
+
+            GLib.idle_add(deliver, future.result())
+
+        future = self._executor.submit(function, *(function_args +
+                                                   (is_current,)))
+        self._futures[future] = group
+        future.add_done_callback(done)
+
+        return future
+
+    def cancel(self, group=None):
+        """
+        abandon the outstanding requests of a group - requests not yet
+        started are never run, running requests stop before their next
+        decode and no callbacks are made for any of them
+        """
+        self._generations[group] = self._generations.get(group, 0) + 1
+
+        for future, future_group in list(self._futures.items()):
+            if future_group == group:
+                future.cancel()
+
+    @staticmethod
+    def _render(filename, pixbuf, sizes, is_current):
+        """
+        worker thread function - the largest size is decoded from the file
+        (or scaled from the pixbuf) and smaller sizes are scaled from that
+        :return: dict of renders or None if the request was cancelled
+        """
+        renders = {}
+        source = None
+
+        for width, height in sorted(sizes, reverse=True):
+            if not is_current():
+                return None
+
+            scaled = None
+
+            if source is None and filename:
+                try:
+                    scaled = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+                        filename, width, height, False)
+                except GLib.Error:
+                    scaled = None
+
+            if scaled is None:
+                base = source if source is not None else pixbuf
+                if base is not None:
+                    scaled = base.scale_simple(width, height,
+                                               GdkPixbuf.InterpType.HYPER)
+
+            renders[(width, height)] = scaled
+
+            if scaled is not None:
+                source = scaled
+
+        return renders
+
+    @staticmethod
+    def _accent_colour(pixbuf, is_current):
+        """
+        worker thread function - quantise a downsampled copy of the pixbuf
+        """
+        if not is_current():
+            return None
+
+        width = min(pixbuf.get_width(), 32)
+        height = min(pixbuf.get_height(), 32)
+        small = pixbuf.scale_simple(width, height,
+                                    GdkPixbuf.InterpType.BILINEAR)
+
+        return dominant_colour(small.get_pixels(), width, height,
+                               small.get_rowstride(), small.get_n_channels())
+
+    def shutdown(self):
+        """
+        stop the worker threads - outstanding requests are abandoned and
+        results already on their way to the main loop are not delivered
+        """
+        self._shutdown = True
+
+        for future in list(self._futures):
+            future.cancel()
+
+        self._executor.shutdown(wait=False)
+
+
+def dominant_colour(pixels, width, height, rowstride, n_channels):
+    """
+    find the dominant colour of raw RGB(A) pixels. Colours are quantised to
+    4 bits per channel, ignoring transparent pixels and - unless nothing
+    else is left - greys, and the average of the most popular bucket
+    returned. NumPy is used when available
+
+    :param pixels: bytes of pixel data as returned by GdkPixbuf.get_pixels
+    :param width: width in pixels
+    :param height: height in pixels
+    :param rowstride: bytes per row
+    :param n_channels: 3 for RGB or 4 for RGBA
+    :return: (red, green, blue) tuple of 0-255 values or None
+    """
+    if numpy is not None:
+        return _dominant_colour_numpy(pixels, width, height, rowstride,
+                                      n_channels)
+
+    rgb = []
+    for y in range(height):
+        row = y * rowstride
+        for x in range(row, row + width * n_channels, n_channels):
+            if n_channels == 4 and pixels[x + 3] < 128:
+                continue
+
+            rgb.append((pixels[x], pixels[x + 1], pixels[x + 2]))
+
+    coloured = [pixel for pixel in rgb
+                if max(pixel) - min(pixel) > 24 and
+                40 < max(pixel) and min(pixel) < 230]
+    if coloured:
+        rgb = coloured
+
+    if not rgb:
+        return None
+
+    buckets = {}
+    for pixel in rgb:
+        bucket = (pixel[0] >> 4, pixel[1] >> 4, pixel[2] >> 4)
+        buckets.setdefault(bucket, []).append(pixel)
+
+    best = max(buckets.values(), key=len)
+    count = len(best)
+
+    return (sum(pixel[0] for pixel in best) // count,
+            sum(pixel[1] for pixel in best) // count,
+            sum(pixel[2] for pixel in best) // count)
+
+
+def _dominant_colour_numpy(pixels, width, height, rowstride, n_channels):
+    """
+    vectorised version of dominant_colour
+    """
+    # the last row of a pixbuf is not padded to the rowstride
+    data = numpy.zeros(height * rowstride, dtype=numpy.uint8)
+    data[:len(pixels)] = numpy.frombuffer(pixels, dtype=numpy.uint8)
+    data = data.reshape(height, rowstride)[:, :width * n_channels]
+    data = data.reshape(-1, n_channels)
+
+    if n_channels == 4:
+        data = data[data[:, 3] >= 128]
+
+    rgb = data[:, :3].astype(numpy.int32)
+
+    maximum = rgb.max(axis=1)
+    minimum = rgb.min(axis=1)
+    coloured = (maximum - minimum > 24) & (maximum > 40) & (minimum < 230)
+    if coloured.any():
+        rgb = rgb[coloured]
+
+    if not len(rgb):
+        return None
+
+    buckets = ((rgb[:, 0] >> 4) << 8) | ((rgb[:, 1] >> 4) << 4) | \
+        (rgb[:, 2] >> 4)
+    best = numpy.bincount(buckets, minlength=4096).argmax()
+    red, green, blue = rgb[buckets == best].mean(axis=0)
+
+    return int(red), int(green), int(blue)
+
+
+class ThumbnailAtlas(object):
+    """
+    persistent cache of pre-scaled album-art thumbnails. Thumbnails are
+    stored as premultiplied ARGB32 pixels in fixed size slots of a single
+    memory-mapped file, together with a compact JSON index keyed by the
+    ExtDB key and the modification time of the art. Each slot starts with a
+    digest of the key and modification time it holds, so an index written
+    before a slot was reused never hands out another album's thumbnail
+    """
+    version = 2
+    header_size = 16
+
+    def __init__(self, filename, width, height, slots=1024):
+        """
+        Initialises the object - nothing is read until first used.
+
+        :param filename: path, without extension, of the atlas and index
+        :param width: thumbnail width
+        :param height: thumbnail height
+        :param slots: number of thumbnails held before the oldest are
+        overwritten
+        """
+        super(ThumbnailAtlas, self).__init__()
+
+        self._atlas_filename = filename + '.atlas'
+        self._index_filename = filename + '.json'
+        self.width = width
+        self.height = height
+        self._stride = cairo.ImageSurface.format_stride_for_width(
+            cairo.FORMAT_ARGB32, width)
+        self._slot_size = self.header_size + self._stride * height
+        self._slot_count = slots
+
+        self._map = None
+        self._failed = False
+        self._index = {}  # key: [slot, mtime]
+        self._slots = {}  # slot: key
+        self._next_slot = 0
+        self._save_id = 0
+
+    def _open(self):
+        """
+        map the atlas and read the index on first use
+        :return: True if the atlas can be used
+        """
+        if self._map is not None:
+            return True
+
+        if self._failed:
+            return False
+
+        try:
+            with open(self._index_filename) as index_file:
+                data = json.load(index_file)
+
+            if data['version'] != self.version or \
+                    data['width'] != self.width or \
+                    data['height'] != self.height or \
+                    data['slots'] != self._slot_count:
+                raise ValueError("atlas geometry has changed")
+
+            index = data['index']
+            next_slot = data['next']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            index = {}
+            next_slot = 0
+
+        size = self._slot_size * self._slot_count
+        try:
+            fd = os.open(self._atlas_filename, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size != size:
+                    # new or damaged atlas - nothing in it can be trusted
+                    os.ftruncate(fd, size)
+                    index = {}
+                    next_slot = 0
+
+                self._map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        except (IOError, OSError, ValueError) as e:
+            print("thumbnail atlas unavailable", e)
+            self._failed = True
+            return False
+
+        self._index = index
+        self._slots = dict((record[0], key) for key, record in index.items())
+        self._next_slot = next_slot % self._slot_count
+
+        return True
+
+    def get(self, key, mtime):
+        """
+        return the thumbnail stored for key
+
+        :param key: ExtDB key string
+        :param mtime: modification time of the art - older thumbnails are
+        ignored
+        :return: cairo.ImageSurface or None
+        """
+        if not self._open():
+            return None
+
+        record = self._index.get(key)
+        if record is None or record[1] != mtime:
+            return None
+
+        offset = record[0] * self._slot_size
+        end = offset + self.header_size
+        if self._map[offset:end] != self._digest(key, mtime):
+            # the slot was reused after the index was last written
+            del self._index[key]
+            self._slots.pop(record[0], None)
+            return None
+
+        data = bytearray(self._map[end:offset + self._slot_size])
+
+        return cairo.ImageSurface.create_for_data(data, cairo.FORMAT_ARGB32,
+                                                  self.width, self.height,
+                                                  self._stride)
+
+    def put(self, key, mtime, pixbuf):
+        """
+        store a thumbnail for key - overwriting the oldest slot if the
+        atlas is full
+
+        :param key: ExtDB key string
+        :param mtime: modification time of the art
+        :param pixbuf: GdkPixbuf of the thumbnail size
+        """
+        if pixbuf.get_width() != self.width or \
+                pixbuf.get_height() != self.height:
+            return
+
+        if not self._open():
+            return
+
+        record = self._index.get(key)
+        if record is None:
+            slot = self._next_slot
+            self._next_slot = (slot + 1) % self._slot_count
+
+            old_key = self._slots.pop(slot, None)
+            if old_key is not None:
+                del self._index[old_key]
+
+            record = [slot, mtime]
+            self._index[key] = record
+            self._slots[slot] = key
+        else:
+            record[1] = mtime
+
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, self.width,
+                                     self.height)
+        context = cairo.Context(surface)
+        Gdk.cairo_set_source_pixbuf(context, pixbuf, 0, 0)
+        context.paint()
+        surface.flush()
+
+        # the header is cleared while the pixels are replaced so that a
+        # slot is never trusted half written
+        offset = record[0] * self._slot_size
+        end = offset + self.header_size
+        self._map[offset:end] = bytes(self.header_size)
+        self._map[end:offset + self._slot_size] = bytes(surface.get_data())
+        self._map[offset:end] = self._digest(key, mtime)
+
+        if self._save_id == 0:
+            self._save_id = GLib.timeout_add_seconds(5, self._save)
+
+    def _digest(self, key, mtime):
+        """
+        slot header identifying what a slot holds
+        """
+        return hashlib.blake2b((key + '\0' + str(mtime)).encode('utf-8'),
+                               digest_size=self.header_size).digest()
+
+    def _save(self, *args):
+        """
+        write the index - written to a temporary file first so that a
+        crash never leaves a half written index behind
+        """
+        self._save_id = 0
+
+        if self._map is None:
+            return False
+
+        data = {'version': self.version,
+                'width': self.width,
+                'height': self.height,
+                'slots': self._slot_count,
+                'next': self._next_slot,
+                'index': self._index}
+
+        try:
+            self._map.flush()
+
+            tmp_filename = self._index_filename + '.tmp'
+            with open(tmp_filename, 'w') as index_file:
+                json.dump(data, index_file, separators=(',', ':'))
+            os.replace(tmp_filename, self._index_filename)
+        except (IOError, OSError) as e:
+            print("failed to save thumbnail index", e)
+
+        return False
+
+    def close(self):
+        """
+        write any outstanding changes and unmap the atlas
+        """
+        if self._save_id:
+            GLib.source_remove(self._save_id)
+            self._save()
+
+        if self._map is not None:
+            self._map.close()
+            self._map = None
@@ -0,0 +1,506 @@
+# -*- Mode: python; coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+#
+# Copyright (C) 2015 - 2016 David Mohammed
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
+
+import ast
+import bisect
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from gi.repository import GLib
+from gi.repository import Gtk
+
+
+def plan_column_moves(current, remembered):
+    """
+    work out the fewest column moves that put the columns into the
+    remembered order. Remembered columns come first, in their remembered
+    order, followed by any others in their current order. The columns
+    forming the longest run already in the right relative order stay put
+    and only the rest are moved
+
+    :param current: list of column titles in their current order
+    :param remembered: list of column titles in the remembered order
+    :return: list of (title, after_title) moves to be applied in turn -
+    after_title is None to move the column in front of all the others
+    """
+    position = dict((title, i) for i, title in enumerate(current))
+
+    target = []
+    for title in remembered:
+        if title in position and title not in target:
+            target.append(title)
+    placed = set(target)
+    for title in current:
+        if title not in placed:
+            placed.add(title)
+            target.append(title)
+
+    # longest increasing subsequence of current positions in target order
+    tails = []  # current position ending the best run of each length
+    tail_index = []  # index into target of each of those positions
+    previous = [None] * len(target)
+
+    for i, title in enumerate(target):
+        pos = position[title]
+        length = bisect.bisect_left(tails, pos)
+
+        if length == len(tails):
+            tails.append(pos)
+            tail_index.append(i)
+        else:
+            tails[length] = pos
+            tail_index[length] = i
+
+        previous[i] = tail_index[length - 1] if length else None
+
+    keep = set()
+    i = tail_index[-1] if tail_index else None
+    while i is not None:
+        keep.add(i)
+        i = previous[i]
+
+    # moving each column directly after its predecessor, front to back,
+    # leaves every column behind the ones before it in the target order
+    moves = []
+    for i, title in enumerate(target):
+        if i not in keep:
+            moves.append((title, target[i - 1] if i else None))
+
+    return moves
+
+
+class ColumnStore(object):
+    """
+    remembers the column order and widths of entry views. The layouts are
+    held in memory and written behind to a compact JSON file. Layouts not
+    used for a while are forgotten and the number kept is bounded, least
+    recently used first out
+    """
+    version = 1
+
+    def __init__(self, filename, legacy_filename=None, max_layouts=256,
+                 max_age=90):
+        """
+        Initialises the object - nothing is read until first used.
+
+        :param filename: path of the JSON store
+        :param legacy_filename: path of the entryview_db.xml written by
+        earlier versions - migrated when there is no JSON store yet
+        :param max_layouts: maximum number of layouts kept
+        :param max_age: days a layout is kept without being used - 0 to
+        keep layouts forever
+        """
+        super(ColumnStore, self).__init__()
+
+        self._filename = filename
+        self._legacy_filename = legacy_filename
+        self.max_layouts = max_layouts
+        self.max_age = max_age
+        # name: {'order': [titles], 'widths': {title: width}, 'seen': time}
+        self._layouts = None
+        self._save_id = 0
+        # name: number bumped whenever the layout of that name changes
+        self._generations = {}
+
+    def get(self, name, fallback=None):
+        """
+        return the layout remembered for name
+
+        :param name: layout name
+        :param fallback: layout name used when nothing is remembered for
+        name
+        :return: dict with 'order' - list of column titles - and 'widths' -
+        dict of column title to width - or None
+        """
+        layouts = self._load()
+        layout = layouts.get(name)
+
+        if layout is None and fallback is not None:
+            layout = layouts.get(fallback)
+            name = fallback
+
+        if layout is not None:
+            now = int(time.time())
+            # only worth writing when the layout would otherwise be
+            # forgotten noticeably early
+            if now - layout.get('seen', 0) > 86400:
+                layout['seen'] = now
+                self._schedule_save()
+
+        return layout
+
+    def set(self, name, order, widths, fallback=None):
+        """
+        remember a layout - written to disk a short while later so that
+        bursts of changes cost a single write
+
+        :param name: layout name
+        :param order: list of column titles
+        :param widths: dict of column title to width
+        :param fallback: layout name also given the layout - so that sources
+        without a layout of their own start from the most recent one
+        """
+        layouts = self._load()
+        now = int(time.time())
+
+        for layout_name in (name, fallback):
+            if layout_name is not None:
+                layouts[layout_name] = {'order': list(order),
+                                        'widths': dict(widths),
+                                        'seen': now}
+                self._generations[layout_name] = \
+                    self._generations.get(layout_name, 0) + 1
+
+        if len(layouts) > self.max_layouts:
+            self._prune(layouts)
+
+        self._schedule_save()
+
+    def rename(self, name, new_name):
+        """
+        move a layout to a new name - replacing any layout of that name
+
+        :param name: layout name
+        :param new_name: name the layout is kept under from now on
+        """
+        layouts = self._load()
+        layout = layouts.pop(name, None)
+        if layout is None:
+            return
+
+        layouts[new_name] = layout
+        self._generations.pop(name, None)
+        self._generations[new_name] = self._generations.get(new_name, 0) + 1
+
+        self._schedule_save()
+
+    def generation(self, name, fallback=None):
+        """
+        identifies the version of the layout get would return for name -
+        it changes only when that layout is set again
+
+        :param name: layout name
+        :param fallback: layout name used when nothing is remembered for
+        name
+        :return: hashable value
+        """
+        if name not in self._load() and fallback is not None:
+            name = fallback
+
+        return name, self._generations.get(name, 0)
+
+    def _schedule_save(self):
+        """
+        write the store a short while from now
+        """
+        if self._save_id == 0:
+            self._save_id = GLib.timeout_add_seconds(2, self._save)
+
+    def _prune(self, layouts):
+        """
+        forget expired layouts and the least recently used beyond
+        max_layouts
+        :return: True if anything was forgotten
+        """
+        count = len(layouts)
+
+        if self.max_age:
+            expired = time.time() - self.max_age * 86400
+            for name in [name for name, layout in layouts.items()
+                         if layout.get('seen', 0) < expired]:
+                del layouts[name]
+
+        if len(layouts) > self.max_layouts:
+            names = sorted(layouts, key=lambda n: layouts[n].get('seen', 0))
+            for name in names[:len(layouts) - self.max_layouts]:
+                del layouts[name]
+
+        return len(layouts) != count
+
+    def _load(self):
+        """
+        read the store on first use
+        :return: dict of layouts
+        """
+        if self._layouts is not None:
+            return self._layouts
+
+        self._layouts = {}
+
+        try:
+            with open(self._filename) as store_file:
+                data = json.load(store_file)
+
+            if data['version'] != self.version:
+                raise ValueError("wrong column store version")
+
+            self._layouts = data['layouts']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            if self._legacy_filename and \
+                    os.path.exists(self._legacy_filename):
+                self._layouts = self._migrate(self._legacy_filename)
+                self._schedule_save()
+
+        # compact the store - write it back if anything was forgotten
+        if self._prune(self._layouts):
+            self._schedule_save()
+
+        return self._layouts
+
+    @staticmethod
+    def _migrate(filename):
+        """
+        read the layouts of the old entryview_db.xml
+        :return: dict of layouts
+        """
+        def safe_string(s):
+            return ''.join([i for i in s if i.isalpha()])
+
+        layouts = {}
+
+        try:
+            pages = ET.parse(filename).getroot().find('pages')
+            page_nodes = pages.findall('page')
+        except (IOError, OSError, AttributeError, ET.ParseError) as e:
+            print("failed to migrate entryview_db.xml", e)
+            return layouts
+
+        for page in page_nodes:
+            name = page.get('name')
+
+            # each page on its own - titles were written unescaped so a
+            # title with a quote in it spoils just its page
+            try:
+                # the order was stored as a comma separated list of quoted
+                # titles
+                order = ast.literal_eval('[' + (page.text or '') + ']')
+                order = [title for title in order if isinstance(title, str)]
+
+                # widths were stored against the titles with all but the
+                # letters removed
+                width_nodes = pages.findall(name)
+            except (ValueError, SyntaxError, TypeError, KeyError) as e:
+                print("failed to migrate column layout", name, e)
+                continue
+
+            saved_widths = {}
+            for node in width_nodes:
+                try:
+                    saved_widths[node.get('column')] = int(node.get('width'))
+                except (ValueError, TypeError):
+                    pass
+
+            widths = {}
+            for title in order:
+                width = saved_widths.get(safe_string(title))
+                if width is not None:
+                    widths[title] = width
+
+            layouts[name] = {'order': order, 'widths': widths,
+                             'seen': int(time.time())}
+
+        return layouts
+
+    def _save(self, *args):
+        """
+        write the store - written to a temporary file first so that a crash
+        never leaves a half written store behind
+        """
+        self._save_id = 0
+
+        if self._layouts is None:
+            return False
+
+        data = {'version': self.version,
+                'layouts': self._layouts}
+
+        try:
+            tmp_filename = self._filename + '.tmp'
+            with open(tmp_filename, 'w') as store_file:
+                json.dump(data, store_file, separators=(',', ':'))
+            os.replace(tmp_filename, self._filename)
+        except (IOError, OSError) as e:
+            print("failed to save column store", e)
+
+        return False
+
+    def close(self):
+        """
+        write any outstanding changes
+        """
+        if self._save_id:
+            GLib.source_remove(self._save_id)
+            self._save()
+
+
+class ColumnAutoSizer(object):
+    """
+    measures entry view columns from a sample of their rows in idle slices,
+    so that a page can be given fixed column widths without GTK measuring
+    every row. Columns start off with an estimate from their titles
+    """
+
+    def __init__(self, sample_rows=500, rows_per_slice=50):
+        """
+        Initialises the object.
+
+        :param sample_rows: maximum number of rows measured
+        :param rows_per_slice: rows measured per idle callback
+        """
+        super(ColumnAutoSizer, self).__init__()
+
+        self.sample_rows = sample_rows
+        self.rows_per_slice = rows_per_slice
+        self._idle_id = 0
+        # model being waited on for rows and the id of its handler
+        self._wait_model = None
+        self._wait_id = 0
+
+    def estimate(self, treeview, columns):
+        """
+        widths to start columns off with until measured - wide enough for
+        their titles
+
+        :param treeview: Gtk.TreeView holding the columns
+        :param columns: list of Gtk.TreeViewColumn
+        :return: dict of column title to width
+        """
+        layout = treeview.create_pango_layout('')
+
+        return dict((col.props.title, self._title_width(col, layout))
+                    for col in columns)
+
+    @staticmethod
+    def _title_width(col, layout):
+        """
+        width of a column title
+        """
+        layout.set_text(col.props.title or '', -1)
+        # leave room for the sort indicator next to the title
+        return layout.get_pixel_size()[0] + 24
+
+    def measure(self, treeview, columns, callback, *args):
+        """
+        measure columns in the background - any measurement in progress is
+        abandoned
+
+        :param treeview: Gtk.TreeView holding the columns
+        :param columns: list of Gtk.TreeViewColumn to measure
+        :param callback: function called once done - func(widths, *args)
+        where widths is a dict of column title to width. Not called until
+        the model has rows - query models are filled in the background
+        """
+        self.cancel()
+
+        model = treeview.get_model()
+        if model is None or not columns:
+            return
+
+        count = model.iter_n_children(None)
+        if count == 0:
+            def remeasure(*ignore):
+                self._idle_id = 0
+                self.measure(treeview, columns, callback, *args)
+                return False
+
+            def inserted(*ignore):
+                # give the rest of the rows a moment to arrive
+                self.cancel()
+                self._idle_id = GLib.timeout_add_seconds(1, remeasure)
+
+            self._wait_model = model
+            self._wait_id = model.connect('row-inserted', inserted)
+            return
+
+        step = max(1, count // self.sample_rows)
+        rows = range(0, count, step)[:self.sample_rows]
+        position = 0
+
+        # one layout for every measurement
+        layout = treeview.create_pango_layout('')
+        widths = {}
+
+        for col in columns:
+            widths[col] = self._title_width(col, layout)
+
+        def measure_slice(*ignore):
+            nonlocal position
+
+            end = min(position + self.rows_per_slice, len(rows))
+            for index in rows[position:end]:
+                tree_iter = model.iter_nth_child(None, index)
+                if tree_iter is None:
+                    # rows removed while we were measuring
+                    end = len(rows)
+                    break
+
+                for col in columns:
+                    col.cell_set_cell_data(model, tree_iter, False, False)
+                    width = self._cells_width(col, layout)
+                    if width > widths[col]:
+                        widths[col] = width
+
+            position = end
+            if position < len(rows):
+                return True
+
+            self._idle_id = 0
+            callback(dict((col.props.title, width)
+                          for col, width in widths.items()), *args)
+            return False
+
+        self._idle_id = GLib.idle_add(measure_slice,
+                                      priority=GLib.PRIORITY_LOW)
+
+    @staticmethod
+    def _cells_width(col, layout):
+        """
+        width of the text of the cell renderers of a column as set up for
+        the current row
+        """
+        width = 0
+
+        for cell in col.get_cells():
+            if not cell.props.visible:
+                continue
+
+            xpad = cell.props.xpad * 2
+            if isinstance(cell, Gtk.CellRendererText):
+                # markup is write-only but text holds what it displays
+                layout.set_text(cell.props.text or '', -1)
+                width += layout.get_pixel_size()[0] + xpad
+            else:
+                width += cell.get_preferred_width(col.get_tree_view())[1] + \
+                    xpad
+
+        return width + col.props.spacing
+
+    def cancel(self):
+        """
+        abandon any measurement in progress
+        """
+        if self._idle_id:
+            GLib.source_remove(self._idle_id)
+            self._idle_id = 0
+
+        if self._wait_id:
+            self._wait_model.disconnect(self._wait_id)
+            self._wait_model = None
+            self._wait_id = 0
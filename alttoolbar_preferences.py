@@ -68,7 +68,13 @@ class GSetting:
                 SOURCE_TOOLBAR='show-source-toolbar',
                 HORIZ_CATEGORIES='horiz-categories',
                 APP_MENU='app-menu-display',
-                DARK_THEME='dark-theme'
+                DARK_THEME='dark-theme',
+                COVER_CACHE_SIZE='cover-cache-size',
+                PREFETCH_DEPTH='prefetch-depth',
+                ACCENT_COLOUR='accent-colour',
+                COLUMN_LAYOUT_EXPIRY='column-layout-expiry',
+                COLUMN_AUTOSIZE='column-autosize',
+                SIDEBAR_FIXED_HEIGHT='sidebar-fixed-height'
             )
 
             self.setting = {}
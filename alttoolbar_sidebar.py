@@ -16,6 +16,7 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
 
+import bisect
 import gettext
 
 from gi.repository import GLib
@@ -31,6 +32,260 @@ from alttoolbar_preferences import CoverLocale
 from alttoolbar_preferences import GSetting
 
 
+class DropImport(object):
+    """
+    adds URIs dropped on a source a slice at a time so that large drops do
+    not block the user interface. Known URIs are pasted in chunks as they
+    are looked up, unknown ones are imported into the library first and
+    pasted as they arrive
+    """
+    chunk_size = 500  # entries per paste
+    slice_time = 8000  # microseconds of lookups per main loop iteration
+
+    def __init__(self, db, source, uris, callback):
+        """
+        Initialises the object.
+
+        :param db: RhythmDB
+        :param source: RBSource to paste the entries into
+        :param uris: list of dropped URIs
+        :param callback: function called with progress -
+        func(drop_import, fraction) where fraction is None once finished
+        """
+        super(DropImport, self).__init__()
+
+        self.db = db
+        self.source = source
+        self._uris = uris
+        self._callback = callback
+
+        self._position = 0
+        self._entries = []
+        self._unknown = set()
+        self._idle_id = 0
+        self._job = None
+        self._job_ids = []
+        self._song_type = None
+        self._imported = 0
+        self._import_total = 0
+
+    def start(self):
+        """
+        start resolving the URIs in the background
+        """
+        self._idle_id = GLib.idle_add(self._resolve_slice,
+                                      priority=GLib.PRIORITY_LOW)
+
+    def cancel(self):
+        """
+        stop the drop - entries pasted so far are left in the source
+        """
+        if self._idle_id:
+            GLib.source_remove(self._idle_id)
+            self._idle_id = 0
+
+        if self._job is not None:
+            self._job.cancel()
+
+        self._finish()
+
+    def _resolve_slice(self, *args):
+        """
+        look up as many URIs as fit in the time slice
+        """
+        deadline = GLib.get_monotonic_time() + self.slice_time
+
+        while self._position < len(self._uris):
+            uri = self._uris[self._position]
+            self._position += 1
+
+            entry = self.db.entry_lookup_by_location(uri)
+            if entry:
+                self._entries.append(entry)
+                if len(self._entries) >= self.chunk_size:
+                    self._paste()
+            else:
+                self._unknown.add(uri)
+
+            if GLib.get_monotonic_time() > deadline:
+                self._progress()
+                return True
+
+        self._idle_id = 0
+        self._paste()
+
+        if self._unknown:
+            self._import_unknown()
+        else:
+            self._finish()
+
+        return False
+
+    def _import_unknown(self):
+        """
+        import the files and folders not yet in the library
+        """
+        self._song_type = self.db.entry_type_get_by_name('song')
+        job = RB.RhythmDBImportJob.new(
+            self.db,
+            self._song_type,
+            self.db.entry_type_get_by_name('ignore'),
+            self.db.entry_type_get_by_name('import-error'))
+
+        for uri in self._unknown:
+            job.add_uri(uri)
+
+        self._import_total = len(self._unknown)
+        self._job = job
+        self._job_ids = [
+            job.connect('entry-added', self._import_entry_added),
+            job.connect('status-changed', self._import_status_changed),
+            job.connect('complete', self._import_complete)]
+
+        job.start()
+        self._progress()
+
+    def _import_entry_added(self, job, entry):
+        if entry.get_entry_type() != self._song_type:
+            # could not be imported
+            return
+
+        self._entries.append(entry)
+        if len(self._entries) >= self.chunk_size:
+            self._paste()
+
+    def _import_status_changed(self, job, total, imported):
+        self._import_total = total
+        self._imported = imported
+        self._progress()
+
+    def _import_complete(self, job):
+        self._paste()
+        self._finish()
+
+    def _paste(self):
+        if self._entries:
+            self.source.paste(self._entries)
+            self._entries = []
+
+    def _progress(self):
+        total = len(self._uris) - len(self._unknown) + self._import_total
+        done = self._position - len(self._unknown) + self._imported
+
+        self._callback(self, min(1.0, done / max(total, 1)))
+
+    def _finish(self):
+        for handler_id in self._job_ids:
+            self._job.disconnect(handler_id)
+        self._job_ids = []
+        self._job = None
+
+        if self._callback is not None:
+            callback = self._callback
+            self._callback = None
+            callback(self, None)
+
+
+class NameIndex(object):
+    """
+    index of names for type-ahead filtering - a sorted list of the words of
+    each name answers prefix searches and a trigram index answers searches
+    for text anywhere in a name, in time proportional to the matches
+    """
+
+    def __init__(self):
+        """
+        Initialises the object.
+        """
+        super(NameIndex, self).__init__()
+
+        self._serials = {}  # key: serial
+        self._keys = {}  # serial: key
+        self._names = {}  # serial: lowercase name
+        self._next_serial = 0
+        self._words = []  # sorted list of (word, serial)
+        self._trigrams = {}  # trigram: set of serials
+
+    def add(self, key, name):
+        """
+        index the name of key - replacing any name already indexed
+
+        :param key: hashable object returned by search
+        :param name: name to index
+        """
+        self.remove(key)
+
+        name = name.lower()
+        serial = self._next_serial
+        self._next_serial += 1
+
+        self._serials[key] = serial
+        self._keys[serial] = key
+        self._names[serial] = name
+
+        for word in set(name.split()):
+            bisect.insort(self._words, (word, serial))
+
+        for trigram in self._name_trigrams(name):
+            self._trigrams.setdefault(trigram, set()).add(serial)
+
+    def remove(self, key):
+        """
+        forget the name of key
+        """
+        serial = self._serials.pop(key, None)
+        if serial is None:
+            return
+
+        del self._keys[serial]
+        name = self._names.pop(serial)
+
+        for word in set(name.split()):
+            i = bisect.bisect_left(self._words, (word, serial))
+            if i < len(self._words) and self._words[i] == (word, serial):
+                del self._words[i]
+
+        for trigram in self._name_trigrams(name):
+            serials = self._trigrams[trigram]
+            serials.discard(serial)
+            if not serials:
+                del self._trigrams[trigram]
+
+    def search(self, text):
+        """
+        find the names with a word starting with text or, for three or more
+        characters, containing text
+
+        :param text: text typed by the user
+        :return: set of keys
+        """
+        text = text.lower().strip()
+        if not text:
+            return set()
+
+        serials = set()
+
+        i = bisect.bisect_left(self._words, (text,))
+        while i < len(self._words) and self._words[i][0].startswith(text):
+            serials.add(self._words[i][1])
+            i += 1
+
+        if len(text) >= 3:
+            postings = sorted((self._trigrams.get(trigram, set())
+                               for trigram in self._name_trigrams(text)),
+                              key=len)
+            # the rarest trigram bounds the work - the rest only narrow it
+            for serial in postings[0]:
+                if serial not in serials and text in self._names[serial]:
+                    serials.add(serial)
+
+        return set(self._keys[serial] for serial in serials)
+
+    @staticmethod
+    def _name_trigrams(name):
+        return set(name[i:i + 3] for i in range(len(name) - 2))
+
+
 class AltToolbarSidebar(Gtk.TreeView):
     expanders = GObject.property(type=str, default='{1:True}')
 
@@ -47,6 +302,7 @@ class AltToolbarSidebar(Gtk.TreeView):
 
         self._drag_dest_source = None
         self._drag_motion_counter = -1
+        self._drops = []  # DropImport in progress
 
         # locale stuff
         cl = CoverLocale()
@@ -58,17 +314,55 @@ class AltToolbarSidebar(Gtk.TreeView):
 
         self._user_clicked = False
 
+        # page: Gtk.TreeIter of its row in the treestore - iters of a
+        # treestore stay valid while their row exists - and
+        # Gtk.TreeRowReference of the page in the display page model. The
+        # treestore row points back at the page
+        self._page_rows = {}
+        self._model_rows = {}
+        # page: ids of the handlers of its deleted and notify::visibility
+        # signals - connected for the pages in the sidebar and those kept
+        # back
+        self._page_ids = {}
+
+        # the source shown in bold - see _on_playing_song_changed
+        self._playing_source = \
+            self.shell.props.shell_player.get_playing_source()
+
+        # pages inserted since the last frame - see _model_page_inserted
+        self._pending_pages = []
+        self._pending_id = 0
+
+        # type-ahead filter - pages are indexed by their displayed name and
+        # while filtering only rows with treestore column 11 set are shown
+        self._name_index = NameIndex()
+        self._visible_column = 2
+        self._filter_rows = None  # pages and categories shown - see
+        # _filter_sidebar
+
         gs = GSetting()
         plugin_settings = gs.get_setting(gs.Path.PLUGIN)
         plugin_settings.bind(gs.PluginKey.EXPANDERS, self, 'expanders',
                              Gio.SettingsBindFlags.DEFAULT)
 
-        # title, source, visible
-        self.treestore = Gtk.TreeStore.new([str, GObject.Object, bool])
-        self.treestore_filter = self.treestore.filter_new(root=None)
-        self.treestore_filter.set_visible_column(2)
-
-        self.set_model(self.treestore_filter)
+        # fixed height mode - every row is the same height and the pages
+        # below a row are only added when it is first expanded. Until then
+        # the row has a placeholder child so that it shows an expander
+        self._fixed_height = gs.get_value(gs.Path.PLUGIN,
+                                          gs.PluginKey.SIDEBAR_FIXED_HEIGHT)
+        # row key (see _row_key): {page: Gtk.TreeRowReference of the page in
+        # the display page model} kept back, and page: row key
+        self._deferred = {}
+        self._deferred_keys = {}
+
+        # title, source, visible and what is rendered - display name,
+        # weight, icon, vertical and horizontal padding, icon visible, drop
+        # progress and progress visible - and whether the row matches the
+        # type-ahead filter
+        self.treestore = Gtk.TreeStore.new([str, GObject.Object, bool,
+                                            str, int, Gio.Icon, int, int,
+                                            bool, int, bool, bool])
+        self._attach_filter()
         context = self.get_style_context()
         context.add_class(Gtk.STYLE_CLASS_SIDEBAR)
         self.set_headers_visible(False)
@@ -76,7 +370,10 @@ class AltToolbarSidebar(Gtk.TreeView):
         # define the headers - not visible by default
         def define_category(text, category):
             local = self.treestore.append(None)
-            self.treestore[local] = [text, None, False]
+            self.treestore[local] = [text, None, False,
+                                     text, Pango.Weight.BOLD, None,
+                                     3 if self._fixed_height else 6, 3,
+                                     False, 0, False, False]
             self._category[category] = local
 
         define_category(_("Local collection"), AltControllerCategory.LOCAL)
@@ -88,7 +385,9 @@ class AltToolbarSidebar(Gtk.TreeView):
             model = self.shell.props.display_page_model
             rootiter = model.get_iter_first()
             depth = 0
+            cl.switch_locale(cl.Locale.LOCALE_DOMAIN)
             self._traverse_rows(model, rootiter, None, depth)
+            cl.switch_locale(cl.Locale.RB)
 
             # switch on/off headers depending upon what's in the model
             self._refresh_headers()
@@ -98,17 +397,7 @@ class AltToolbarSidebar(Gtk.TreeView):
 
             # now expand or collapse each expander that we have saved from a
             # previous session
-            expanders = eval(self.expanders)
-
-            print(expanders)
-            print(self.expanders)
-            for category in expanders:
-                print(category)
-                path = self.treestore.get_path(self._category[category])
-
-                if path and expanders[category]:
-                    # self._user_clicked = True
-                    self.expand_row(path, False)  # expanders[category])
+            self._restore_expanders()
 
             return False
 
@@ -128,16 +417,54 @@ class AltToolbarSidebar(Gtk.TreeView):
         self.text_renderer = renderer
         column.pack_start(renderer, False)
 
-        column.set_cell_data_func(pixbuf_renderer, self._set_pixbuf)
-        column.set_cell_data_func(renderer, self._set_text)
+        # everything rendered is worked out once per row and kept in the
+        # treestore - see _render_values
+        pixbuf_renderer.props.follow_state = True
+        pixbuf_renderer.props.xpad = 3
+        column.add_attribute(pixbuf_renderer, 'gicon', 5)
+        column.add_attribute(pixbuf_renderer, 'visible', 8)
+
+        renderer.props.ellipsize = Pango.EllipsizeMode.END
+        column.add_attribute(renderer, 'text', 3)
+        column.add_attribute(renderer, 'weight', 4)
+        column.add_attribute(renderer, 'ypad', 6)
+        column.add_attribute(renderer, 'xpad', 7)
+
+        # progress of drops onto the source - see on_drag_data_received
+        progress_renderer = Gtk.CellRendererProgress()
+        progress_renderer.set_fixed_size(48, -1)
+        column.pack_end(progress_renderer, False)
+        column.add_attribute(progress_renderer, 'value', 9)
+        column.add_attribute(progress_renderer, 'visible', 10)
 
         self.tree_column = column
 
         self.append_column(column)
         self.set_expander_column(column)
+
+        if self._fixed_height:
+            # GTK then measures a single row rather than every row - which
+            # needs every column to be of fixed size
+            column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            column.set_expand(True)
+            self.set_fixed_height_mode(True)
+
         self.show_all()
         self.set_can_focus(True)
 
+        # the type-ahead filter replaces GTK's interactive search - the
+        # toolbar places the search bar above the sidebar
+        self.set_enable_search(False)
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.connect('search-changed', self._on_search_changed)
+        self.search_bar = Gtk.SearchBar()
+        self.search_bar.add(self.search_entry)
+        self.search_bar.connect_entry(self.search_entry)
+        self.search_bar.set_show_close_button(True)
+        self.search_bar.connect('notify::search-mode-enabled',
+                                self._on_search_mode)
+        self.search_bar.show_all()
+
         cl = CoverLocale()
         cl.switch_locale(cl.Locale.RB)
 
@@ -145,7 +472,6 @@ class AltToolbarSidebar(Gtk.TreeView):
         # display_page_model signals to keep the sidebar model in sync
         model = self.shell.props.display_page_model
         self._cpi = model.connect('page-inserted', self._model_page_inserted)
-        self._crd = model.connect('row-deleted', self._model_page_deleted)
         self._crc = model.connect('row-changed', self._model_page_changed)
 
         # when we click on the sidebar -
@@ -167,13 +493,37 @@ class AltToolbarSidebar(Gtk.TreeView):
         self.connect('drag-data-received',
                      self.on_drag_data_received)
         self.connect('drag-motion', self.on_drag_motion)
+        self.connect('key-press-event', self._on_key_press)
+        self.connect('test-expand-row', self._on_test_expand_row)
+        self.connect('direction-changed', self._on_direction_changed)
 
     def cleanup(self):
         model = self.shell.props.display_page_model
         model.disconnect(self._cpi)
-        model.disconnect(self._crd)
         model.disconnect(self._crc)
 
+        for page, ids in self._page_ids.items():
+            for handler in ids:
+                page.disconnect(handler)
+        self._page_ids = {}
+
+        if self._pending_id:
+            GLib.source_remove(self._pending_id)
+            self._pending_id = 0
+
+        for drop in list(self._drops):
+            drop.cancel()
+
+    def _attach_filter(self):
+        """
+           (re)create the filter of visible rows over the treestore and
+           display it
+        """
+        self.treestore_filter = self.treestore.filter_new(root=None)
+        self.treestore_filter.set_visible_column(self._visible_column)
+
+        self.set_model(self.treestore_filter)
+
     def on_drag_drop(self, widget, context, x, y, time):
         """
         Callback called when a drag operation finishes over the treeview
@@ -241,7 +591,7 @@ class AltToolbarSidebar(Gtk.TreeView):
                         tree = self.shell.props.display_page_tree
                         if tree:
                             tree.select(self._drag_dest_source)
-                            self.rbtree.expand_all()
+                            self._expand_rbtree_to(self._drag_dest_source)
 
                     self._drag_motion_counter = -1
                     return False
@@ -273,28 +623,168 @@ class AltToolbarSidebar(Gtk.TreeView):
 
         drag_context.finish(True, False, time)
 
-        uris = data.get_uris()
+        # the entries are looked up, imported and pasted in the background
+        drop = DropImport(self.shell.props.db, dest_source, data.get_uris(),
+                          self._drop_progress)
+        self._drops.append(drop)
+        drop.start()
 
-        entries = []
-        for uri in uris:
-            entry = self.shell.props.db.entry_lookup_by_location(uri)
-            if entry:
-                entries.append(entry)
+    def _drop_progress(self, drop, fraction):
+        """
+        DropImport callback - show the progress against the source row
+        """
+        if fraction is None:
+            self._drops.remove(drop)
+            if any(other.source == drop.source for other in self._drops):
+                # another drop onto the same source will report
+                return
+
+        treeiter = self._page_iter(drop.source)
+        if treeiter is not None:
+            self.treestore.set(treeiter, [9, 10],
+                               [int((fraction or 0) * 100),
+                                fraction is not None])
+
+    def _on_key_press(self, widget, event):
+        """
+        escape cancels the drops in progress - typing starts the type-ahead
+        filter
+        """
+        if event.keyval == Gdk.KEY_Escape and self._drops:
+            for drop in list(self._drops):
+                drop.cancel()
+            return True
+
+        return self.search_bar.handle_event(event)
+
+    def _on_search_changed(self, entry):
+        self._filter_sidebar(entry.get_text())
+
+    def _on_search_mode(self, search_bar, param):
+        if not search_bar.get_search_mode():
+            self.search_entry.set_text('')
+            self._filter_sidebar('')
+
+    def _filter_sidebar(self, text):
+        """
+           show only the pages whose name matches text, together with the
+           rows above them. Only rows whose visibility changes are touched
+        :param text: filter text - empty to show everything
+        """
+        if not text.strip():
+            if self._filter_rows is None:
+                return
+
+            for key in self._filter_rows:
+                self._set_filter_row(key, False)
+            self._filter_rows = None
+
+            self._visible_column = 2
+            self._attach_filter()
+            self._restore_expanders()
+            return
+
+        # only pages in the treestore are indexed
+        self._populate_all()
+
+        rows = set()
+        for page in self._name_index.search(text):
+            treeiter = self._page_iter(page)
+
+            # the page and each row above it - stopping at a row already
+            # shown for another match
+            while treeiter is not None:
+                key = self._row_key(treeiter)
+                if key in rows:
+                    break
+
+                rows.add(key)
+                treeiter = self.treestore.iter_parent(treeiter)
 
-        dest_source.paste(entries)
+        old_rows = self._filter_rows or set()
+        for key in old_rows - rows:
+            self._set_filter_row(key, False)
+        for key in rows - old_rows:
+            self._set_filter_row(key, True)
+
+        if self._filter_rows is None:
+            self._visible_column = 11
+            self._attach_filter()
+
+        self._filter_rows = rows
+        self.expand_all()
+
+    def _on_test_expand_row(self, view, treeiter, path):
+        """
+           the rows kept back below a row in fixed height mode are added
+           just before it is expanded
+        """
+        if self._deferred:
+            self._populate(
+                self.treestore_filter.convert_iter_to_child_iter(treeiter))
+
+        return False
+
+    def _set_filter_row(self, key, visible):
+        """
+           set the type-ahead filter column of a row
+        :param key: row key - see _row_key
+        """
+        treeiter = self._key_iter(key)
+
+        if treeiter is not None:
+            self.treestore[treeiter][11] = visible
+
+    def _refilter(self):
+        """
+           re-run the type-ahead filter after pages have changed
+        """
+        if self._filter_rows is not None:
+            self._filter_sidebar(self.search_entry.get_text())
+
+    def _restore_expanders(self):
+        """
+           expand the categories as remembered from the previous session
+        """
+        expanders = eval(self.expanders)
+
+        print(expanders)
+        print(self.expanders)
+        for category in expanders:
+            print(category)
+            path = self.treestore.get_path(self._category[category])
+            path = self.treestore_filter.convert_child_path_to_path(path)
+
+            if path and expanders[category]:
+                # self._user_clicked = True
+                self.expand_row(path, False)  # expanders[category])
 
     def _on_playing_song_changed(self, *args):
         """
-          signal when a playing song changes - need to invoke a tree-refresh
-          to ensure the user can see which source
+          signal when a playing song changes - the rows of the previously
+          and newly playing sources are updated so the user can see which
+          source is playing
         :param args:
         :return:
         """
         print("playing song changed")
-        if hasattr(self.plugin, "db"):  # curious crash when exiting - lets not
-            # send the queue_draw in this case
-            print("queuing")
-            self.queue_draw()
+        if not hasattr(self.plugin, "db"):  # curious crash when exiting -
+            # lets not touch the rows in this case
+            return
+
+        source = self.shell.props.shell_player.get_playing_source()
+        if source == self._playing_source:
+            # the usual case - still playing from the same source
+            return
+
+        previous = self._playing_source
+        self._playing_source = source
+
+        # changing the weight emits row-changed for just these two rows
+        for page in (previous, source):
+            treeiter = self._page_iter(page)
+            if treeiter is not None:
+                self.treestore[treeiter][4] = self._page_weight(page)
 
     def on_renderertext_edited(self, renderer, path, new_text):
         print("edited")
@@ -316,14 +806,18 @@ class AltToolbarSidebar(Gtk.TreeView):
                 continue
 
             if depth == 0:
-                category_iter = self._get_category_iter(store[treeiter][1])
-                leaf_iter = self.treestore.append(category_iter)
+                parent_iter = self._get_category_iter(store[treeiter][1])
             else:
-                leaf_iter = self.treestore.append(new_parent_iter)
+                parent_iter = new_parent_iter
 
-            self.treestore[leaf_iter][1] = store[treeiter][1]
-            self.treestore[leaf_iter][0] = ""
-            self.treestore[leaf_iter][2] = True
+            if self._fixed_height and depth == 0:
+                # added when the category is expanded - see _populate
+                self._defer(parent_iter, store[treeiter][1], store, treeiter)
+                treeiter = store.iter_next(treeiter)
+                continue
+
+            leaf_iter = self._add_page_row(parent_iter, store[treeiter][1],
+                                           store, treeiter)
 
             if store.iter_has_child(treeiter):
                 childiter = store.iter_children(treeiter)
@@ -331,9 +825,68 @@ class AltToolbarSidebar(Gtk.TreeView):
             treeiter = store.iter_next(treeiter)
 
     def _model_page_changed(self, model, path, page_iter):
-        print(model[page_iter][1].props.name)
-        print(path)
-        # self._model_page_inserted(model, path, page_iter)
+        """
+          signal from the displaytreemodel - a page has been renamed or
+          changed its icon
+        """
+        page = model[page_iter][1]
+        treeiter = self._page_iter(page)
+
+        if treeiter is None:
+            return
+
+        cl = CoverLocale()
+        cl.switch_locale(cl.Locale.LOCALE_DOMAIN)
+        renamed = self._update_page_row(page, treeiter)
+        cl.switch_locale(cl.Locale.RB)
+
+        if renamed:
+            self._refilter()
+
+    def _on_direction_changed(self, widget, previous_direction):
+        """
+          the text direction follows the language - when it changes every
+          page row is worked out again so names are translated afresh
+        """
+        cl = CoverLocale()
+        cl.switch_locale(cl.Locale.LOCALE_DOMAIN)
+
+        renamed = False
+        for page, treeiter in list(self._page_rows.items()):
+            renamed = self._update_page_row(page, treeiter) or renamed
+
+        cl.switch_locale(cl.Locale.RB)
+
+        if renamed:
+            self._refilter()
+
+    def _update_page_row(self, page, treeiter):
+        """
+          work out again what is rendered for a page row - called with the
+          plugin locale switched in. The row is only set if something
+          differs since setting unchanged values still redraws it
+        :return: True if the displayed name has changed
+        """
+        values = self._render_values(page,
+                                     self.treestore.iter_depth(treeiter) + 1)
+        old_values = self.treestore[treeiter][3:9]
+
+        # get_gicon may hand out a new but equal icon each time
+        old_icon, icon = old_values[2], values[2]
+        if old_icon is None or icon is None:
+            same_icon = old_icon is icon
+        else:
+            same_icon = old_icon.equal(icon)
+
+        if not same_icon or old_values[:2] != values[:2] or \
+                old_values[3:] != values[3:]:
+            self.treestore.set(treeiter, list(range(3, 9)), values)
+
+        if old_values[0] == values[0]:
+            return False
+
+        self._name_index.add(page, values[0])
+        return True
 
     def _tree_inserted(self, model, path, page_iter):
         print(path)
@@ -343,67 +896,123 @@ class AltToolbarSidebar(Gtk.TreeView):
         self._model_page_inserted(model, model[path][1], page_iter)
 
     def _model_page_inserted(self, model, page, page_iter):
+        """
+           a page has been added to the display page model. Pages are
+           queued and added together just before the next frame, so a burst
+           of insertions - a device with many playlists being plugged in -
+           costs a single update of the sidebar
+        """
         print(page)
-        print(page_iter)
-        parent_iter = model.iter_parent(page_iter)
-        print(parent_iter)
-
-        def find_lookup_rows(store, treeiter, page):
-            while treeiter is not None:
-
-                found_page = store[treeiter][1]
-                print(found_page)
-                if found_page is not None and found_page == page:
-                    # print("found %s" % found_page.props.name)
-                    return treeiter
-
-                if store.iter_has_child(treeiter):
-                    childiter = store.iter_children(treeiter)
-                    ret = find_lookup_rows(store, childiter, page)
-
-                    if ret:
-                        return ret
-
-                treeiter = store.iter_next(treeiter)
-
-            print("nothing found")
-            return None
 
         # first check if we've already got the page in the model
-        rootiter = self.treestore.get_iter_first()
-        if find_lookup_rows(self.treestore, rootiter, page):
+        if page in self._page_rows:
             return
 
+        parent_iter = model.iter_parent(page_iter)
+
         if (parent_iter and isinstance(model[parent_iter][1],
                                        RB.DisplayPageGroup)) or \
                 not parent_iter:
             # the parent of the inserted row is a top-level item in the
             # display-page-model
-            # print("top level")
-            category_iter = self._get_category_iter(page)
-            leaf_iter = self.treestore.append(category_iter)
+            parent_page = None
         else:
-            # the parent is another source so we need to find the iter in our
-            # model to hang it off
-            # print("child level")
-            searchpage = model[parent_iter][1]
-            # print("####", searchpage)
-            leaf_iter = find_lookup_rows(self.treestore, rootiter, searchpage)
-            # print("##2", leaf_iter)
-            leaf_iter = self.treestore.append(leaf_iter)
-
-        self.treestore[leaf_iter][1] = page
-        self.treestore[leaf_iter][0] = ""
-        self.treestore[leaf_iter][2] = True
+            # the parent is another source so we need to find its row in
+            # our model to hang it off
+            parent_page = model[parent_iter][1]
+
+        ref = Gtk.TreeRowReference.new(model, model.get_path(page_iter))
+        self._pending_pages.append((page, parent_page, ref))
+
+        if self._pending_id == 0:
+            self._pending_id = GLib.idle_add(self._insert_pending_pages,
+                                             priority=GLib.PRIORITY_HIGH_IDLE)
+
+    def _insert_pending_pages(self, *args):
+        """
+           add the queued pages to the treestore in one go. Large batches
+           are added with the treestore detached from the view so neither
+           the filter nor the view track each row
+        """
+        self._pending_id = 0
+        pending = self._pending_pages
+        self._pending_pages = []
 
+        cl = CoverLocale()
+        cl.switch_locale(cl.Locale.LOCALE_DOMAIN)
+
+        bulk = len(pending) > 16
+        if bulk:
+            # remember what is expanded - detaching loses it
+            expanded = []
+
+            def remember(view, path, *ignore):
+                path = self.treestore_filter.convert_path_to_child_path(path)
+                expanded.append(Gtk.TreeRowReference.new(self.treestore,
+                                                         path))
+
+            self.map_expanded_rows(remember, None)
+            self.set_model(None)
+            # dropping the last reference disconnects the filter from the
+            # treestore - a new one is made once the rows are in
+            self.treestore_filter = None
+
+        inserted = []
+        for page, parent_page, ref in pending:
+            if page in self._page_rows or not ref.valid():
+                # a duplicate or already deleted again
+                continue
+
+            if parent_page is None:
+                parent_iter = self._get_category_iter(page)
+            else:
+                parent_iter = self._page_iter(parent_page)
+
+            model = ref.get_model()
+
+            if self._fixed_height:
+                if parent_page is not None and parent_iter is None:
+                    # the parent is kept back - the page is found below it
+                    # in the display page model once the parent is added
+                    continue
+
+                key = self._row_key(parent_iter)
+                if key in self._deferred:
+                    self._deferred[key][page] = ref
+                    self._deferred_keys[page] = key
+                    self._watch_page(page)
+                    continue
+
+            inserted.append(self._add_page_row(
+                parent_iter, page, model, model.get_iter(ref.get_path())))
+
+        cl.switch_locale(cl.Locale.RB)
         self._refresh_headers()
 
-        if "PlaylistSource" in type(page).__name__:
-            # a playlist of somesort has been added - so lets put the user into
-            # edit mode
-            self.edit_playlist(leaf_iter)
+        if bulk:
+            self._attach_filter()
+
+            for ref in expanded:
+                if ref.valid():
+                    path = self.treestore_filter.convert_child_path_to_path(
+                        ref.get_path())
+                    if path is not None:
+                        self.expand_row(path, False)
+
+        if len(inserted) == 1 and "PlaylistSource" in type(
+                self.treestore[inserted[0]][1]).__name__:
+            # a playlist of somesort has been added - so lets put the user
+            # into edit mode. Not done for a batch - that is a device or an
+            # import rather than the user creating a playlist
+            self.edit_playlist(inserted[0])
+
+        self._expand_rbtree_to(*[self.treestore[treeiter][1]
+                                 for treeiter in inserted])
 
-        self.rbtree.expand_all()
+        if inserted:
+            self._refilter()
+
+        return False
 
     def edit_playlist(self, leaf_iter):
         """
@@ -424,56 +1033,89 @@ class AltToolbarSidebar(Gtk.TreeView):
 
         GLib.timeout_add_seconds(1, delayed, None)
 
-    def _model_page_deleted(self, model, path):
+    def _page_deleted(self, page):
         """
-          signal from the displaytreemodel - we dont actually know what is
-          deleted ... just that something has been
-        :param model:
-        :param path:
-        :return:
+          signal from a page in the sidebar or kept back - it has been
+          removed from the display page model, or hidden from it
+        :param page: RBDisplayPage
         """
+        key = self._deferred_keys.get(page)
+        if key is not None and key in self._deferred:
+            children = self._deferred[key]
+            children.pop(page, None)
+
+            if not children:
+                # nothing left to expand to - drops the placeholder
+                treeiter = self._key_iter(key)
+                if treeiter is not None:
+                    self._populate(treeiter)
+                else:
+                    del self._deferred[key]
+
+        treeiter = self._page_rows.get(page)
+        if treeiter is not None:
+            self._remove_row(treeiter)
+        else:
+            self._forget_page(page)
 
-        # first do a reverse lookup so that we can search quicker later
-        # dict of sources in the sidebar model with their treeiter
-        lookup = {}
-        rootiter = self.treestore.get_iter_first()
-
-        def find_lookup_rows(store, treeiter):
-            while treeiter is not None:
-                # if store[treeiter][0] == "":
-                #    lookup[store[treeiter][1]] = treeiter
+        self._refresh_headers()
+        self._refilter()
 
-                if store[treeiter][1] is not None:
-                    lookup[store[treeiter][1]] = treeiter
+    def _remove_row(self, treeiter):
+        """
+           remove a page row - the pages of the row and of every row below
+           it are forgotten
+        :param treeiter: treestore iter of the page
+        """
+        pending = [treeiter]
+        while pending:
+            rowiter = pending.pop()
+            page = self.treestore[rowiter][1]
+            if page is not None:
+                self._forget_page(page)
 
-                if store.iter_has_child(treeiter):
-                    childiter = store.iter_children(treeiter)
-                    find_lookup_rows(store, childiter)
-                treeiter = store.iter_next(treeiter)
+            childiter = self.treestore.iter_children(rowiter)
+            while childiter is not None:
+                pending.append(childiter)
+                childiter = self.treestore.iter_next(childiter)
 
-        find_lookup_rows(self.treestore, rootiter)
+        self.treestore.remove(treeiter)
 
-        # next iterate through the displaytreemodel - where we have a matching
-        # source, delete it from our lookup
-        def find_rows(store, treeiter):
-            while treeiter is not None:
-                if store[treeiter][1] in lookup:
-                    del lookup[store[treeiter][1]]
+    def _watch_page(self, page):
+        """
+           find out when a page goes - see _page_deleted
+        """
+        if page not in self._page_ids:
+            self._page_ids[page] = (
+                page.connect('deleted', self._page_deleted),
+                page.connect('notify::visibility', self._page_visibility))
 
-                if store.iter_has_child(treeiter):
-                    childiter = store.iter_children(treeiter)
-                    find_rows(store, childiter)
-                treeiter = store.iter_next(treeiter)
+    def _page_visibility(self, page, param):
+        """
+          signal from a page in the sidebar or kept back - RB hides some
+          pages, such as import errors, while they have nothing to show.
+          The display page model then drops the page and our row goes too -
+          _tree_inserted adds it back once the page is shown again
+        """
+        if not page.props.visibility:
+            self._page_deleted(page)
 
-        rootiter = model.get_iter_first()
-        find_rows(model, rootiter)
+    def _forget_page(self, page):
+        """
+           drop a page from the indexes - along with the pages kept back
+           below it
+        :param page: RBDisplayPage
+        """
+        for handler in self._page_ids.pop(page, ()):
+            page.disconnect(handler)
 
-        # from what is left is the stuff to remove from our treeview
-        # (treestore)
-        for source in lookup:
-            self.treestore.remove(lookup[source])
+        self._page_rows.pop(page, None)
+        self._model_rows.pop(page, None)
+        self._deferred_keys.pop(page, None)
+        self._name_index.remove(page)
 
-        self._refresh_headers()
+        for child in self._deferred.pop(page, {}):
+            self._forget_page(child)
 
     def _row_click(self, widget, event):
         """
@@ -495,7 +1137,7 @@ class AltToolbarSidebar(Gtk.TreeView):
             # we have a source
             self._user_clicked = True
             self.shell.props.display_page_tree.select(active_object)
-            self.rbtree.expand_all()
+            self._expand_rbtree_to(active_object)
             if self._last_click_source == active_object:
                 self.text_renderer.props.editable = \
                     "PlaylistSource" in type(active_object).__name__
@@ -529,63 +1171,46 @@ class AltToolbarSidebar(Gtk.TreeView):
             self._user_clicked = False
             return
 
-        # first do a reverse lookup so that we can search quicker later
-        # dict of sources in the sidebar model with their treeiter
-        lookup = {}
-        rootiter = self.treestore_filter.get_iter_first()
+        treeiter = self._page_iter(page)
+        if treeiter is None and self._deferred:
+            self._populate_to(page)
+            treeiter = self._page_iter(page)
 
-        def find_lookup_rows(store, treeiter):
-            while treeiter is not None:
-
-                if store[treeiter][1] is not None:
-                    lookup[store[treeiter][1]] = treeiter
-                    print(store[treeiter][1].props.name)
-
-                if store.iter_has_child(treeiter):
-                    childiter = store.iter_children(treeiter)
-                    find_lookup_rows(store, childiter)
-                treeiter = store.iter_next(treeiter)
-
-        find_lookup_rows(self.treestore_filter, rootiter)
+        if treeiter is None:
+            return
 
-        if page in lookup:
-            path = self.treestore_filter.get_path(lookup[page])
+        path = self.treestore_filter.convert_child_path_to_path(
+            self.treestore.get_path(treeiter))
+        if path is not None:
             self.expand_to_path(path)
             self.set_cursor(path)
 
-    def _set_text(self, column, renderer, model, treeiter, arg):
-        source = model[treeiter][1]
-        if source is None:
-            renderer.props.weight = Pango.Weight.BOLD
-            renderer.props.text = model[treeiter][0]
-            renderer.props.visible = model[treeiter][2]
-        else:
-            renderer.props.visible = True
-            player = self.shell.props.shell_player
-            playing = \
-                player.get_playing and player.get_playing_source() == source
-
-            cl = CoverLocale()
-            cl.switch_locale(cl.Locale.LOCALE_DOMAIN)
-            translation = gettext.gettext(source.props.name)
-            cl.switch_locale(cl.Locale.RB)
-            renderer.props.text = translation
-            if playing:
-                renderer.props.weight = Pango.Weight.BOLD
-            else:
-                renderer.props.weight = Pango.Weight.NORMAL
-            renderer.props.ypad = 3
+    def _render_values(self, page, depth):
+        """
+           what is rendered for a page row - called with the plugin locale
+           switched in so that the page name is translated
+        :param page: RBDisplayPage
+        :param depth: depth of the row in the treestore - 2 for a page
+        directly under a category
+        :return: list of the values of treestore columns 3 to 8
+        """
+        ret_bool, controller = self.toolbar.is_controlled(page)
 
-        path = model.get_path(treeiter)
+        return [gettext.gettext(page.props.name),
+                self._page_weight(page),
+                controller.get_gicon(page),
+                3,
+                0,
+                depth == 2]  # children of child pages have no icon
 
-        if path.get_depth() == 1:
-            renderer.props.ypad = 6
-            renderer.props.xpad = 3
-        else:
-            renderer.props.ypad = 3
-            renderer.props.xpad = 0
+    def _page_weight(self, page):
+        """
+           the playing source is shown in bold
+        """
+        if page is not None and page == self._playing_source:
+            return Pango.Weight.BOLD
 
-        renderer.props.ellipsize = Pango.EllipsizeMode.END
+        return Pango.Weight.NORMAL
 
     def _refresh_headers(self):
         treeiter = self.treestore.get_iter_first()
@@ -596,25 +1221,211 @@ class AltToolbarSidebar(Gtk.TreeView):
 
             treeiter = self.treestore.iter_next(treeiter)
 
-    def _set_pixbuf(self, column, renderer, model, treeiter, arg):
-        source = model[treeiter][1]
-        if source is None:
-            renderer.props.pixbuf = None
-        else:
-            ret_bool, controller = self.toolbar.is_controlled(source)
+    def _add_page_row(self, parent_iter, page, model, model_iter):
+        """
+           append a row for a page to the treestore and index it - called
+           with the plugin locale switched in
+        :param parent_iter: treestore iter of the category or parent page
+        :param page: RBDisplayPage
+        :param model: model the page was found in
+        :param model_iter: iter of the page in model
+        :return: treestore iter of the new row
+        """
+        depth = self.treestore.iter_depth(parent_iter) + 2 \
+            if parent_iter else 1
+        values = self._render_values(page, depth)
+        leaf_iter = self.treestore.append(
+            parent_iter, ["", page, True] + values + [0, False, False])
+        self._name_index.add(page, values[0])
+
+        self._page_rows[page] = leaf_iter
+        self._watch_page(page)
+
+        # the page is found again in the display page model itself - a
+        # filtered view of it would lose rows that are merely hidden
+        page_model = self.shell.props.display_page_model
+        if isinstance(model, Gtk.TreeModelFilter) and \
+                model.get_model() == page_model:
+            model_iter = model.convert_iter_to_child_iter(model_iter)
+            model = page_model
+        elif model != page_model:
+            found, model_iter = page_model.find_page(page)
+            model = page_model if found else None
+
+        if model is not None:
+            self._model_rows[page] = Gtk.TreeRowReference.new(
+                model, model.get_path(model_iter))
+
+        return leaf_iter
+
+    def _page_iter(self, page):
+        """
+           treestore iter of the row for a page
+        :param page: RBDisplayPage
+        :return: Gtk.TreeIter or None if the page is not in the sidebar
+        """
+        return self._page_rows.get(page)
 
-            renderer.props.gicon = controller.get_gicon(source)
-            renderer.props.follow_state = True
+    def _row_key(self, treeiter):
+        """
+           key of a treestore row - the page of the row or for a category
+           the path string of its row
+        """
+        page = self.treestore[treeiter][1]
+        if page is not None:
+            return page
 
-        path = model.get_path(treeiter)
-        if path.get_depth() == 2:
-            renderer.props.visible = True  # must be a child so show the
-            # pixbuf renderer
-        else:
-            renderer.props.visible = False  # headers or children of child
-            # dont have pixbuf's so no renderer to display
+        return self.treestore.get_path(treeiter).to_string()
+
+    def _key_iter(self, key):
+        """
+           treestore iter of a row key - see _row_key
+        :return: Gtk.TreeIter or None if there is no such row
+        """
+        if isinstance(key, str):
+            return self.treestore.get_iter_from_string(key)
+
+        return self._page_iter(key)
+
+    def _defer(self, parent_iter, page, model, model_iter):
+        """
+           keep a page back until the row it belongs under is first
+           expanded - see _populate
+        :param parent_iter: treestore iter of the category or parent page
+        :param page: RBDisplayPage
+        :param model: model the page was found in
+        :param model_iter: iter of the page in model
+        """
+        key = self._row_key(parent_iter)
+        if key not in self._deferred:
+            self._deferred[key] = {}
+            # only there for the expander - never seen as the row is
+            # populated before it expands
+            self.treestore.append(
+                parent_iter, ["", None, True, "", Pango.Weight.NORMAL, None,
+                              3, 0, False, 0, False, False])
+
+        self._deferred[key][page] = Gtk.TreeRowReference.new(
+            model, model.get_path(model_iter))
+        self._deferred_keys[page] = key
+        self._watch_page(page)
+
+    def _defer_children(self, parent_iter, model, model_iter):
+        """
+           keep back the children of a page in the display page model
+        :param parent_iter: treestore iter of the page
+        """
+        childiter = model.iter_children(model_iter)
+        while childiter is not None:
+            self._defer(parent_iter, model[childiter][1], model, childiter)
+            childiter = model.iter_next(childiter)
+
+    def _populate(self, treeiter):
+        """
+           add the pages kept back below a row - their own children are
+           kept back in turn
+        :param treeiter: treestore iter of the category or page
+        """
+        children = self._deferred.pop(self._row_key(treeiter), None)
+        if children is None:
+            return
+
+        # the placeholder is the only child without a page
+        placeholder = self.treestore.iter_children(treeiter)
+        while placeholder is not None and \
+                self.treestore[placeholder][1] is not None:
+            placeholder = self.treestore.iter_next(placeholder)
+
+        cl = CoverLocale()
+        cl.switch_locale(cl.Locale.LOCALE_DOMAIN)
+
+        for page, ref in children.items():
+            self._deferred_keys.pop(page, None)
+            if page in self._page_rows or not ref.valid():
+                # a duplicate or already deleted again
+                continue
+
+            model = ref.get_model()
+            model_iter = model.get_iter(ref.get_path())
+            leaf_iter = self._add_page_row(treeiter, page, model, model_iter)
+            self._defer_children(leaf_iter, model, model_iter)
+
+        cl.switch_locale(cl.Locale.RB)
+
+        # removed last so the row keeps its expander throughout
+        if placeholder is not None:
+            self.treestore.remove(placeholder)
+
+        self._refresh_headers()
+
+    def _populate_to(self, page):
+        """
+           add the rows kept back above a page and the page itself
+        :param page: RBDisplayPage
+        """
+        model = self.shell.props.display_page_model
+        found, page_iter = model.find_page(page)
+        if not found:
+            return
+
+        pages = []
+        while page_iter is not None:
+            if not isinstance(model[page_iter][1], RB.DisplayPageGroup):
+                pages.insert(0, model[page_iter][1])
+            page_iter = model.iter_parent(page_iter)
+
+        if not pages:
+            return
+
+        self._populate(self._get_category_iter(pages[0]))
+        for parent_page in pages[:-1]:
+            treeiter = self._page_iter(parent_page)
+            if treeiter is None:
+                return
+            self._populate(treeiter)
+
+    def _populate_all(self):
+        """
+           add every row kept back
+        """
+        while self._deferred:
+            key = next(iter(self._deferred))
+            treeiter = self._key_iter(key)
+            if treeiter is None:
+                # went together with its placeholder
+                del self._deferred[key]
+            else:
+                self._populate(treeiter)
+
+    def _expand_rbtree_to(self, *pages):
+        """
+           make pages reachable in the display page tree by expanding the
+           rows above them - each parent is looked at once and nothing is
+           done if it is already expanded
+        :param pages: RBDisplayPage
+        """
+        model = self.shell.props.display_page_model
+        if self.rbtree.get_model() != model:
+            # paths would not match - fall back to expanding everything
+            if pages:
+                self.rbtree.expand_all()
+            return
+
+        parents = set()
+        for page in pages:
+            ref = self._model_rows.get(page)
+            if ref is None or not ref.valid():
+                continue
+
+            path = ref.get_path()
+            if path.get_depth() < 2 or not path.up():
+                continue
 
-        renderer.props.xpad = 3
+            key = path.to_string()
+            if key not in parents:
+                parents.add(key)
+                if not self.rbtree.row_expanded(path):
+                    self.rbtree.expand_to_path(path)
 
     def _get_category_iter(self, source):
         ret_bool, controller = self.toolbar.is_controlled(source)
@@ -17,9 +17,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
 
 import os
-import xml.etree.ElementTree as ET
 from datetime import datetime, date
-from xml.etree.ElementTree import SubElement
 
 import rb
 from gi.repository import GLib
@@ -31,6 +29,7 @@ from gi.repository import Gtk
 from gi.repository import Pango
 from gi.repository import RB
 
+from alttoolbar_cache import LRUCache
 from alttoolbar_controller import AltAndroidController
 from alttoolbar_controller import AltCoverArtBrowserController
 from alttoolbar_controller import AltCoverArtPlaySourceController
@@ -45,6 +44,11 @@ from alttoolbar_controller import AltRadioController
 from alttoolbar_controller import AltSoundCloudController
 from alttoolbar_controller import AltStandardLocalController
 from alttoolbar_controller import AltStandardOnlineController
+from alttoolbar_coverart import CoverArtLoader
+from alttoolbar_coverart import ThumbnailAtlas
+from alttoolbar_entryview import ColumnAutoSizer
+from alttoolbar_entryview import ColumnStore
+from alttoolbar_entryview import plan_column_moves
 from alttoolbar_preferences import CoverLocale
 from alttoolbar_preferences import GSetting
 from alttoolbar_rb3compat import gtk_version
@@ -53,6 +57,25 @@ from alttoolbar_sidebar import AltToolbarSidebar
 from alttoolbar_widget import SmallProgressBar
 from alttoolbar_widget import SmallScale
 
+# album-art sizes for the toolbar thumbnail and the cover popover
+cover_size = 34
+popover_cover_size = 300
+
+# tint applied by the accent-colour setting - {0} is the album-art colour
+accent_css = """
+.alttoolbar-accent {{
+    background-image: none;
+    background-color: alpha({0}, 0.3);
+}}
+.alttoolbar-accent-progress:selected,
+.alttoolbar-accent-progress highlight,
+.alttoolbar-accent-progress .highlight {{
+    background-image: none;
+    background-color: {0};
+    border-color: {0};
+}}
+"""
+
 
 class AT(object):
     @staticmethod
@@ -94,37 +117,29 @@ class AltToolbarBase(GObject.Object):
         if not os.path.exists(folder):
             os.makedirs(folder)
 
-        self._entryview_filename = folder + "/entryview_db.xml"
-
-        self._save_cols_loop = 0
-
-        db_version = "1"
-        try:
-            # if the db has not been deleted or is screwed up or is an older
-            #  version than expected then
-            # assume via the except we are starting from a clean db
-            self._entryview_tree = ET.parse(self._entryview_filename)
-            self._entryview_root = self._entryview_tree.getroot()
+        gs = GSetting()
 
-            db = self._entryview_root.find("database")
-            if db.text != db_version:
-                raise ValueError("wrong database version")
+        # column layouts are loaded on the first page change
+        self._column_store = ColumnStore(
+            folder + "/entryview_db.json",
+            legacy_filename=folder + "/entryview_db.xml",
+            max_age=gs.get_value(gs.Path.PLUGIN,
+                                 gs.PluginKey.COLUMN_LAYOUT_EXPIRY))
 
-        except:
-            text = """
-                <root>
-                   <pages>
-                   </pages>
-                </root>
-                """
-
-            self._entryview_root = ET.fromstring(text)
-            db = SubElement(self._entryview_root, "database")
-            db.text = db_version
-            self._entryview_tree = ET.ElementTree(self._entryview_root)
+        self._save_cols_loop = 0
+        # layout name: fingerprint of the last persisted column layout
+        self._column_fingerprints = {}
+        # page: (treeview, column count, generation of its layout in the
+        # column store) when its remembered layout was last applied
+        self._applied_layouts = {}
+        self._column_autosize = gs.get_value(gs.Path.PLUGIN,
+                                             gs.PluginKey.COLUMN_AUTOSIZE)
+        self._column_sizer = ColumnAutoSizer()
+        # page: titles of the columns only given an estimated width so far
+        # - not persisted until measured
+        self._estimated_columns = {}
 
         # bind the source-toolbar gsettings
-        gs = GSetting()
         plugin_settings = gs.get_setting(gs.Path.PLUGIN)
         plugin_settings.bind(gs.PluginKey.SOURCE_TOOLBAR, self,
                              'source_toolbar_visible',
@@ -205,9 +220,13 @@ class AltToolbarBase(GObject.Object):
         :return:
         """
 
-        for page in self._process_entryview:
-            self.disconnect(self._process_entryview[page]['size'])
-            self.disconnect(self._process_entryview[page]['changed'])
+        for page, ids in self._process_entryview.items():
+            ids['treeview'].disconnect(ids['size'])
+            ids['treeview'].disconnect(ids['changed'])
+            page.disconnect(ids['name'])
+
+        self._column_sizer.cancel()
+        self._column_store.close()
 
         self.purge_builder_content()
 
@@ -315,6 +334,47 @@ class AltToolbarBase(GObject.Object):
 
         treeview = entryview.get_child()
 
+        applied = (treeview, len(treeview.get_columns()),
+                   self._column_store.generation(*self._layout_names(page)))
+        if self._applied_layouts.get(page) == applied and \
+                not self._estimated_columns.get(page):
+            # same view, same columns and no layout saved since we last
+            # arranged it - nothing to do
+            return
+
+        self._column_sizer.cancel()
+
+        # widths go on straight away so that the first layout of the page
+        # uses them rather than measuring the visible rows
+        layout = self._column_store.get(*self._layout_names(page))
+        if layout is not None:
+            self._restore_column_widths(treeview, layout['widths'])
+
+        if self._column_autosize:
+            # columns we know no width for are fixed from the start too -
+            # first to an estimate and then to what a sample of their rows
+            # needs - so GTK never measures every row. Measured widths are
+            # persisted by the size-allocate handler once applied, estimates
+            # never are so the columns are measured again next time
+            widths = layout['widths'] if layout is not None else {}
+            unsized = [col for col in treeview.get_columns()
+                       if col.props.title is not None and
+                       col.props.title.strip() != "" and
+                       not col.get_expand() and
+                       col.props.title not in widths]
+
+            if unsized:
+                self._restore_column_widths(
+                    treeview, self._column_sizer.estimate(treeview, unsized))
+                self._estimated_columns[page] = \
+                    set(col.props.title for col in unsized)
+
+                def measured(widths):
+                    self._estimated_columns.pop(page, None)
+                    self._restore_column_widths(treeview, widths)
+
+                self._column_sizer.measure(treeview, unsized, measured)
+
         def move_col(*args):
             cols = treeview.get_columns()
 
@@ -324,70 +384,49 @@ class AltToolbarBase(GObject.Object):
             base_col = None
             base_col_found = False
 
-            for col in cols:
+            for i, col in enumerate(cols):
                 title = col.props.title
                 if title is not None and title.strip() != "":
                     if not base_col_found:
-                        base_col = cols[cols.index(col) - 1]
+                        # the untitled column in front of the titled ones -
+                        # None if there is none
+                        base_col = cols[i - 1] if i else None
                         base_col_found = True
 
-                    print(title)
                     col.set_reorderable(True)
                     current_cols.append(col)
 
             if page in self._process_entryview:
                 # disconnect previous signal handler if have been connected
-                # before otherwise we'll trigger stuff when moving columns
-                treeview.disconnect(self._process_entryview[page]['changed'])
-                treeview.disconnect(self._process_entryview[page]['size'])
+                # before otherwise we'll trigger stuff when moving columns.
+                # RB may have re-created the view since then
+                ids = self._process_entryview[page]
+                ids['treeview'].disconnect(ids['changed'])
+                ids['treeview'].disconnect(ids['size'])
+                page.disconnect(ids['name'])
 
             # now move columns around depending upon saved values
-            safe_name = self._safe_string(type(page).__name__)
-            lookup = "pages/page[@name='" + safe_name + "']"
-            element = self._entryview_root.find(lookup)
-
-            if element is not None:
-                # we've got something remembered to lets move cols around
-                remembered_col_titles = eval(element.text)
-
-                remembered_cols = []
-
-                for title in remembered_col_titles:
-                    for col in current_cols:
-                        if col.props.title == title:
-                            remembered_cols.append(col)
-                            break
-
-                for i in range(len(remembered_cols)):
-                    for col in current_cols:
-                        if col.props.title == remembered_cols[i].props.title:
-                            if current_cols.index(col) != i:
-                                print(i, col.props.title)
-
-                                if i == 0:
-                                    treeview.move_column_after(col, base_col)
-                                else:
-                                    pos = i - 1
-
-                                    treeview.move_column_after(col,
-                                                               remembered_cols[
-                                                                   pos])
-                                break
-
-                                # now reset column widths
-                                # for col in current_cols:
-                                #    safe_col_name = self._safe_string(
-                                # col.props.title)
-
-                                #    lookup = "pages/" + safe_name + "[
-                                # @column='" + \
-                                #             safe_col_name + "']"
-                                #    col_node = self._entryview_root.find(
-                                # lookup)
-
-                                #    if col_node is not None:
-                                #        col.set_fixed_width(int(
-                                # col_node.get("width")))
+            name, type_name = self._layout_names(page)
+            layout = self._column_store.get(name, type_name)
+
+            if layout is not None:
+                # we've got something remembered to lets move cols around -
+                # only the columns out of order are moved and all in the
+                # same main loop iteration, so the view is laid out once
+                titled = dict((col.props.title, col) for col in current_cols)
+                moves = plan_column_moves([col.props.title
+                                           for col in current_cols],
+                                          layout['order'])
+
+                for title, after in moves:
+                    print(title, after)
+                    treeview.move_column_after(
+                        titled[title],
+                        titled[after] if after is not None else base_col)
+
+                self._column_fingerprints[name] = \
+                    self._column_fingerprint(layout['order'],
+                                             layout['widths'])
 
             # now connect new signal handler
             ids = {}
@@ -397,8 +436,16 @@ class AltToolbarBase(GObject.Object):
 
             ids['size'] = treeview.connect('size-allocate',
                                            self._entryview_size_allocate, page)
+            ids['treeview'] = treeview
+
+            # a renamed playlist takes its layout with it
+            ids['name'] = page.connect('notify::name', self._page_renamed)
+            ids['layout'] = name
 
             self._process_entryview[page] = ids
+            self._applied_layouts[page] = (
+                treeview, len(cols),
+                self._column_store.generation(name, type_name))
 
         # add a short delay otherwise RB will move after us nulling our
         # achievement
@@ -408,10 +455,64 @@ class AltToolbarBase(GObject.Object):
     def _safe_string(self, s):
         return ''.join([i for i in s if i.isalpha()])
 
+    def _layout_names(self, page):
+        """
+           column store names for a page - its own and that of its type to
+           fall back on. Sources are told apart by their entry type, which
+           each device has its own of. Playlists share the entry type of
+           their library or device so their name is added
+           :param page - RBDisplayPage
+           :return: (name, type name)
+        """
+        type_name = self._safe_string(type(page).__name__)
+        name = type_name
+
+        try:
+            entry_type = page.props.entry_type
+        except AttributeError:
+            # not a source
+            entry_type = None
+
+        if entry_type is not None:
+            name += ':' + entry_type.props.name
+
+        if entry_type is None or isinstance(page, RB.PlaylistSource):
+            name += ':' + (page.props.name or '')
+
+        return name, type_name
+
+    def _page_renamed(self, page, param):
+        """
+           keep the layout of a page whose name is part of its layout name
+        """
+        ids = self._process_entryview.get(page)
+        if ids is None:
+            return
+
+        name = self._layout_names(page)[0]
+        if name == ids['layout']:
+            return
+
+        self._column_store.rename(ids['layout'], name)
+
+        fingerprint = self._column_fingerprints.pop(ids['layout'], None)
+        if fingerprint is not None:
+            self._column_fingerprints[name] = fingerprint
+
+        ids['layout'] = name
+
     def _entryview_size_allocate(self, treeview, allocation, page):
         self._entryview_column_changed(treeview, page)
 
     def _entryview_column_changed(self, treeview, page):
+        # size-allocate fires on every window resize and pane drag - only
+        # bother saving when the order or a width has actually changed
+        name, type_name = self._layout_names(page)
+        fingerprint = self._column_fingerprint(
+            *self._entryview_column_layout(treeview, page))
+        if fingerprint == self._column_fingerprints.get(name):
+            return
+
         # we basically don't want to process column-changed signals
         # when closing because these are fired by RB during the entry-view
         # cleanup & columns being deleted
@@ -445,74 +546,70 @@ class AltToolbarBase(GObject.Object):
         print("entryview column changed")
         print(page)
 
-        def quoted_string(array):
-            return ','.join("'{0}'".format(x) for x in array)
+        name, type_name = self._layout_names(page)
 
-        safe_name = self._safe_string(type(page).__name__)
-        lookup = "pages/page[@name='" + safe_name + "']"
-        node = self._entryview_root.find(lookup)
+        arr, widths = self._entryview_column_layout(treeview, page)
 
-        pages = self._entryview_root.find("pages")
+        if len(arr) < 2:
+            # nothing to do so quit before writing
+            return
+
+        fingerprint = self._column_fingerprint(arr, widths)
+        if fingerprint == self._column_fingerprints.get(name):
+            return
 
-        if node is None:
-            print("new node")
-            node = SubElement(pages, 'page')
-            node.set("name", safe_name)
+        print(arr)
 
+        self._column_fingerprints[name] = fingerprint
+        self._column_store.set(name, arr, widths, type_name)
+
+        # the view already shows what has just been saved
+        self._applied_layouts[page] = (
+            treeview, len(treeview.get_columns()),
+            self._column_store.generation(name, type_name))
+
+    @staticmethod
+    def _restore_column_widths(treeview, widths):
+        """
+           give the titled columns of an entry view their remembered widths -
+           as fixed widths so GTK does not autosize them. Expanding columns
+           are left alone to soak up the remaining space
+           :param widths: dict of column title to width
+        """
+        for col in treeview.get_columns():
+            width = widths.get(col.props.title)
+
+            if not width or col.get_expand() or \
+                    col.get_fixed_width() == width:
+                continue
+
+            col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            col.set_fixed_width(width)
+
+    def _entryview_column_layout(self, treeview, page):
+        """
+           titles and widths of the titled columns of an entry view -
+           columns with an estimated width have no width
+           :return: (list of titles, dict of title to width)
+        """
         arr = []
-        cols = treeview.get_columns()
+        widths = {}
+        estimated = self._estimated_columns.get(page, ())
 
-        for col in cols:
+        for col in treeview.get_columns():
             if col.props.title is not None and col.props.title != "":
                 arr.append(col.props.title)
-                # print (col.get_width())
-                safe_col_name = self._safe_string(col.props.title)
-                lookup = "pages/" + safe_name + "[@column='" + safe_col_name \
-                         + "']"
-                col_node = self._entryview_root.find(lookup)
-
-                if col_node is None:
-                    col_node = SubElement(pages, safe_name)
-                    col_node.set("column", safe_col_name)
-
-                col_node.set("width", str(col.get_width()))
+                if col.props.title not in estimated:
+                    widths[col.props.title] = col.get_width()
 
-        if len(arr) < 2:
-            # nothing to do so quit before writing
-            return
+        return arr, widths
 
-        output = quoted_string(arr)
-        print(output)
-
-        node.text = output
-
-        self._indent_xml(self._entryview_root)
-        self._entryview_tree.write(self._entryview_filename,
-                                   xml_declaration=True)
-
-    def _indent_xml(self, elem, level=0, more_sibs=False):
-        i = "\n"
-        if level:
-            i += (level - 1) * '  '
-        num_kids = len(elem)
-        if num_kids:
-            if not elem.text or not elem.text.strip():
-                elem.text = i + "  "
-                if level:
-                    elem.text += '  '
-            count = 0
-            for kid in elem:
-                self._indent_xml(kid, level + 1, count < num_kids - 1)
-                count += 1
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-                if more_sibs:
-                    elem.tail += '  '
-        else:
-            if level and (not elem.tail or not elem.tail.strip()):
-                elem.tail = i
-                if more_sibs:
-                    elem.tail += '  '
+    @staticmethod
+    def _column_fingerprint(order, widths):
+        """
+           hashable summary of a column layout used to spot real changes
+        """
+        return tuple(order), tuple(widths.get(title) for title in order)
 
     def reset_toolbar(self, page):
         """
@@ -614,17 +711,60 @@ class AltToolbarShared(AltToolbarBase):
 
         # Prepare Album Art Displaying
         self.album_art_db = GObject.new(RB.ExtDB, name="album-art")
+        self._cover_loader = CoverArtLoader()
+
+        gs = GSetting()
+        cache_size = gs.get_value(gs.Path.PLUGIN,
+                                  gs.PluginKey.COVER_CACHE_SIZE)
+        self._cover_cache = LRUCache(256,
+                                     max_bytes=cache_size * 1024 * 1024,
+                                     sizeof=self._covers_size)
+        self._cover_added_id = self.album_art_db.connect(
+            'added', self._on_album_art_added)
+        self._cover_atlases = {}  # scale factor: ThumbnailAtlas
+
+        self._prefetch_depth = gs.get_value(gs.Path.PLUGIN,
+                                            gs.PluginKey.PREFETCH_DEPTH)
+        self._prefetch_entries = []
+        self._prefetch_id = 0
+        self._queue_model = None
+        self._queue_model_ids = []
+
+        self._accent = gs.get_value(gs.Path.PLUGIN,
+                                    gs.PluginKey.ACCENT_COLOUR)
+        self._accent_cache = LRUCache(1024)  # ExtDB key: colour or None
+        self._accent_colour = None
+        self._accent_provider = None
+        self._cover_key = None
 
         what, width, height = Gtk.icon_size_lookup(Gtk.IconSize.SMALL_TOOLBAR)
         self.icon_width = width
-        self.cover_pixbuf = None
+        self.cover_surface = None
+        self.cover_popover = None
+        self._popover_hide_id = 0
         self._controllers = {}
         self._tooltip_exceptions = ['album_cover']
         self._moved_controls = []
 
+        # now-playing display - see display_song
+        self.entry = None
+        self._song_label_content = None
+        self._display_song_entry = None
+        self._display_song_id = 0
+        self._markup_cache = LRUCache(64)
+        self._cover_generation = 0
+
     def initialise(self, plugin):
         super(AltToolbarShared, self).initialise(plugin)
 
+        # an edit to the play queue changes what plays next
+        queue_source = self.shell.props.queue_source
+        if queue_source and self._prefetch_depth > 0:
+            self._queue_model = queue_source.props.query_model
+            for signal in ('row-inserted', 'row-deleted', 'rows-reordered'):
+                self._queue_model_ids.append(
+                    self._queue_model.connect(signal, self._on_queue_edited))
+
         ui = rb.find_plugin_file(plugin, 'ui/alttoolbar.ui')
 
         cl = CoverLocale()
@@ -635,6 +775,9 @@ class AltToolbarShared(AltToolbarBase):
         self.load_builder_content(builder)
         self.connect_builder_content(builder)
 
+        self.album_cover.connect('notify::scale-factor',
+                                 self._on_cover_scale_changed)
+
         self._controllers['generic'] = AltGenericController(self)
         # every potential source should have its own controller - we use this
         # to categorise the source and provide specific capability for
@@ -674,8 +817,9 @@ class AltToolbarShared(AltToolbarBase):
 
         image_name = 'view-list-symbolic'
 
-        box_listview = Gtk.Box()
+        box_listview = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         box_listview.pack_start(display_tree, True, True, 0)
+        self._box_listview = box_listview
         # box_listview.show_all()
         self.stack.add_named(box_listview, "listview")
         self.stack.child_set_property(box_listview, "icon-name", image_name)
@@ -741,6 +885,17 @@ class AltToolbarShared(AltToolbarBase):
         self.song_progress.show_all()
         self.song_progress_box.pack_start(self.song_progress, False, True, 1)
 
+        if self._accent:
+            # one provider for the lifetime of the toolbar - a colour change
+            # only reloads its data
+            self._accent_provider = Gtk.CssProvider()
+            Gtk.StyleContext.add_provider_for_screen(
+                Gdk.Screen.get_default(), self._accent_provider,
+                Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+            self.small_bar.get_style_context().add_class('alttoolbar-accent')
+            self.song_progress.get_style_context().add_class(
+                'alttoolbar-accent-progress')
+
         # Bring Builtin Actions to plugin
         for (a, b) in ((self.play_button, "play"),
                        (self.prev_button, "play-previous"),
@@ -763,16 +918,7 @@ class AltToolbarShared(AltToolbarBase):
         self._repeat = Repeat(self.shell, self.repeat_toggle)
 
         if gtk_version() >= 3.12:
-            self.cover_popover = Gtk.Popover.new(self.album_cover)
-            image = Gtk.Image.new()
-            self.cover_popover.add(image)
-
-            self._popover_inprogress = 0
-            self.cover_popover.set_modal(False)
-            self.cover_popover.connect('leave-notify-event',
-                                       self._on_cover_popover_mouse_over)
-            self.cover_popover.connect('enter-notify-event',
-                                       self._on_cover_popover_mouse_over)
+            # the cover popover itself is created on first hover
             # detect when mouse moves out of the cover image
             # (it has a parent eventbox)
             box = self.album_cover_eventbox
@@ -790,6 +936,11 @@ class AltToolbarShared(AltToolbarBase):
             self.sidebar = AltToolbarSidebar(self, self.rbtree)
             self.sidebar.show_all()
             self.rbtreeparent.add(self.sidebar)
+
+            # the sidebar's type-ahead filter goes above the source list
+            self._box_listview.pack_start(self.sidebar.search_bar, False,
+                                          True, 0)
+            self._box_listview.reorder_child(self.sidebar.search_bar, 0)
         else:
             self.rbtreeparent.add(self.rbtree)
 
@@ -822,6 +973,34 @@ class AltToolbarShared(AltToolbarBase):
 
         super(AltToolbarShared, self).cleanup()
 
+        if self._display_song_id:
+            GLib.source_remove(self._display_song_id)
+            self._display_song_id = 0
+
+        self._cover_loader.shutdown()
+        self.album_art_db.disconnect(self._cover_added_id)
+        self._cover_cache.clear()
+        for atlas in self._cover_atlases.values():
+            atlas.close()
+
+        if self._popover_hide_id:
+            GLib.source_remove(self._popover_hide_id)
+            self._popover_hide_id = 0
+
+        self._cancel_prefetch()
+        for handler_id in self._queue_model_ids:
+            self._queue_model.disconnect(handler_id)
+        self._queue_model_ids = []
+
+        if self._accent_provider:
+            Gtk.StyleContext.remove_provider_for_screen(
+                Gdk.Screen.get_default(), self._accent_provider)
+            self.small_bar.get_style_context().remove_class(
+                'alttoolbar-accent')
+            self.song_progress.get_style_context().remove_class(
+                'alttoolbar-accent-progress')
+            self._accent_provider = None
+
         if self.sidebar:
             self.sidebar.cleanup()
 
@@ -872,52 +1051,59 @@ class AltToolbarShared(AltToolbarBase):
         return False, self._controllers['generic']
 
     def show_cover_tooltip(self, tooltip):
-        if (self.cover_pixbuf is not None):
-            scale = self.cover_pixbuf.scale_simple(300, 300,
-                                                   GdkPixbuf.InterpType.HYPER)
+        if (self.cover_surface is not None):
             if gtk_version() >= 3.12:
-                if self.cover_popover.get_visible():
+                if self.cover_popover is None:
+                    self._create_cover_popover()
+                elif self.cover_popover.get_visible():
                     return False
                 image = self.cover_popover.get_child()
-                image.set_from_pixbuf(scale)
+                if image.props.surface != self.cover_surface:
+                    image.set_from_surface(self.cover_surface)
                 self.cover_popover.show_all()
             else:
-                tooltip.set_icon(scale)
+                surface = self.cover_surface
+                tooltip.set_icon(
+                    Gdk.pixbuf_get_from_surface(surface, 0, 0,
+                                                surface.get_width(),
+                                                surface.get_height()))
             return True
         else:
             return False
 
-    def _on_cover_popover_mouse_over(self, widget, eventcrossing):
-        if eventcrossing.type == Gdk.EventType.ENTER_NOTIFY:
-            if self._popover_inprogress == 0:
-                self._popover_inprogress = 1
-            else:
-                self._popover_inprogress = 2
-
-            self._popover_inprogress_count = 0
-            print("enter")
-        else:
-            print("exit")
-            self._popover_inprogress = 3
+    def _create_cover_popover(self):
+        """
+           create the popover displaying the larger album-art
+        """
+        self.cover_popover = Gtk.Popover.new(self.album_cover)
+        image = Gtk.Image.new()
+        self.cover_popover.add(image)
 
-        # print (eventcrossing.type)
+        self.cover_popover.set_modal(False)
+        self.cover_popover.connect('leave-notify-event',
+                                   self._on_cover_popover_mouse_over)
+        self.cover_popover.connect('enter-notify-event',
+                                   self._on_cover_popover_mouse_over)
 
-        def delayed(*args):
-            if self._popover_inprogress == 3:
-                self._popover_inprogress_count += 1
-                if self._popover_inprogress_count < 5:
-                    return True
+    def _on_cover_popover_mouse_over(self, widget, eventcrossing):
+        """
+           hide the cover popover shortly after the mouse leaves both the
+           cover image and the popover - moving between them cancels the
+           pending hide
+        """
+        if self._popover_hide_id:
+            GLib.source_remove(self._popover_hide_id)
+            self._popover_hide_id = 0
 
-                self.cover_popover.hide()
-                self._popover_inprogress = 0
-                return False
-            else:
-                return True
+        if eventcrossing.type != Gdk.EventType.ENTER_NOTIFY and \
+                self.cover_popover is not None:
+            self._popover_hide_id = GLib.timeout_add(500,
+                                                     self._hide_cover_popover)
 
-        if self._popover_inprogress == 1:
-            print("addding timeout")
-            self._popover_inprogress = 2
-            GLib.timeout_add(100, delayed)
+    def _hide_cover_popover(self, *args):
+        self._popover_hide_id = 0
+        self.cover_popover.hide()
+        return False
 
     def show_slider(self, visibility):
         self.song_box.set_visible(visibility)
@@ -926,31 +1112,471 @@ class AltToolbarShared(AltToolbarBase):
         self.song_progress.set_sensitive(toggle)
 
     def display_song(self, entry):
+        """
+           schedule the now-playing label and cover for the entry.
+           Bursts of song-changed and property-changed signals are collapsed
+           so that only the latest entry is rendered, once per frame
+           :param RBEntry
+        """
+        self._display_song_entry = entry
+
+        if self._display_song_id == 0:
+            # run ahead of the next redraw so the update lands in this frame
+            self._display_song_id = GLib.idle_add(
+                self._display_song_idle,
+                priority=GLib.PRIORITY_HIGH_IDLE + 10)
+
+    def _display_song_idle(self, *args):
+        """
+           render the latest entry scheduled by display_song
+        """
+        self._display_song_id = 0
+        entry = self._display_song_entry
+        self._display_song_entry = None
+
+        content = self._song_label_markup(entry)
+
+        if entry == self.entry and content == self._song_label_content:
+            # property-change echo - nothing visible has changed
+            return False
+
         self.entry = entry
+        self._song_label_content = content
 
-        self.cover_pixbuf = None
+        self.cover_surface = None
         self.album_cover.clear()
+        self._cancel_cover_requests()
 
         if self.plugin.inline_label:
-            ret = self._inline_progress_label(entry)
+            self._inline_progress_label(content)
         else:
-            ret = self._combined_progress_label(entry)
+            self._combined_progress_label(content)
 
-        if ret:
+        if content is not None:
             key = entry.create_ext_db_key(RB.RhythmDBPropType.ALBUM)
+            self._request_cover(key)
+        else:
+            self._cover_key = None
+            self._apply_accent(None)
+
+        self._schedule_prefetch()
+
+        return False
+
+    def _on_queue_edited(self, *args):
+        """
+           play queue model signal handler - what plays next has changed
+        """
+        self._schedule_prefetch()
+
+    def _cancel_prefetch(self):
+        """
+           abandon any prefetching of upcoming tracks
+        """
+        if self._prefetch_id:
+            GLib.source_remove(self._prefetch_id)
+            self._prefetch_id = 0
+
+        self._prefetch_entries = []
+        self._cover_loader.cancel('prefetch')
+
+    def _schedule_prefetch(self):
+        """
+           prepare the label markup and album-art of the upcoming tracks at
+           low priority so that the next song change is a cache hit
+        """
+        self._cancel_prefetch()
+
+        if self._prefetch_depth <= 0 or self.entry is None:
+            return
+
+        # upcoming entries are looked up in the first idle call
+        self._prefetch_entries = None
+        self._prefetch_id = GLib.idle_add(self._prefetch_idle,
+                                          priority=GLib.PRIORITY_LOW)
+
+    def _upcoming_entries(self, entry, depth):
+        """
+           the entries expected to play after entry - queued entries first
+           then the following entries of the playing source. When shuffling
+           only the queued entries can be known
+           :param entry: RBEntry currently playing
+           :param depth: maximum number of entries to return
+           :return: list of RBEntry
+        """
+        entries = []
+
+        if self._queue_model:
+            for row in self._queue_model:
+                if len(entries) >= depth:
+                    return entries
+
+                if row[0] != entry:
+                    entries.append(row[0])
+
+        player = self.shell.props.shell_player
+        source = player.get_playing_source()
+
+        if not source or source == self.shell.props.queue_source:
+            return entries
+
+        try:
+            ret, shuffle, repeat = player.get_playback_state()
+        except:
+            shuffle = False
+
+        if shuffle:
+            return entries
+
+        model = source.props.query_model
+        next_entry = entry
+        while model and len(entries) < depth:
+            next_entry = model.get_next_from_entry(next_entry)
+            if next_entry is None:
+                break
+
+            entries.append(next_entry)
+
+        return entries
+
+    def _prefetch_idle(self, *args):
+        """
+           prefetch one upcoming entry per idle call
+        """
+        if self._prefetch_entries is None:
+            self._prefetch_entries = \
+                self._upcoming_entries(self.entry, self._prefetch_depth)
+
+        if not self._prefetch_entries:
+            self._prefetch_id = 0
+            return False
+
+        entry = self._prefetch_entries.pop(0)
+
+        self._song_label_markup(entry)
+
+        key = entry.create_ext_db_key(RB.RhythmDBPropType.ALBUM)
+        cache_key = key.to_string()
+
+        if cache_key not in self._cover_cache:
+            filename = self._lookup_cover(key)
+            if filename:
+                scale = self.album_cover.get_scale_factor()
+                self._cover_loader.load(filename, None,
+                                        self._cover_render_sizes(scale),
+                                        self._cache_cover_renders,
+                                        cache_key, filename, scale,
+                                        group='prefetch')
+
+        return True
+
+    def _cancel_cover_requests(self):
+        """
+           abandon the album-art requests of the previous song - ExtDB
+           lookups cannot be withdrawn so their callbacks are ignored by
+           generation, decoding and scaling not yet done is cancelled
+        """
+        self._cover_generation += 1
+        self._cover_loader.cancel('cover')
+
+    def _request_cover(self, key):
+        """
+           display the album-art for the ExtDB key - from the memory cache
+           if we have rendered it before, then from the thumbnail atlas,
+           then decoded from the stored art file and finally via an ExtDB
+           request when there is no stored art
+           :param key: RBExtDBKey
+        """
+        cache_key = key.to_string()
+        self._cover_key = cache_key
+
+        covers = self._cover_cache.get(cache_key)
+        if covers is not None:
+            self._display_cover(covers)
+            self._request_accent(cache_key, covers=covers)
+            return
+
+        filename = self._lookup_cover(key)
+        mtime = self._cover_mtime(filename)
+        if mtime is not None:
+            scale = self.album_cover.get_scale_factor()
+            thumbnail = self._cover_atlas(scale).get(cache_key, mtime)
+
+            if thumbnail is not None:
+                # warm start - show the stored thumbnail straight away and
+                # decode the popover render in the background
+                thumbnail.set_device_scale(scale, scale)
+                covers = {cover_size: thumbnail}
+                self._display_cover(covers)
+
+                size = popover_cover_size * scale
+                self._cover_loader.load(filename, None, [(size, size)],
+                                        self._cover_popover_rendered,
+                                        covers, cache_key, scale,
+                                        group='cover')
+                return
+
+            # the art is on disk - decoded straight at the sizes we need
+            # rather than ExtDB decoding it at full size first
+            self._cover_loader.load(filename, None,
+                                    self._cover_render_sizes(scale),
+                                    self._cover_file_rendered,
+                                    key, cache_key, filename, scale,
+                                    group='cover')
+            return
+
+        self.album_art_db.request(key,
+                                  self.display_song_album_art_callback,
+                                  (self._cover_generation, cache_key))
+
+    def _cover_file_rendered(self, renders, key, cache_key, filename, scale):
+        """
+           CoverArtLoader callback with the renders of art decoded from its
+           stored file - ExtDB is asked instead if the file could not be
+           decoded
+        """
+        if renders.get((cover_size * scale, cover_size * scale)) is None:
             self.album_art_db.request(key,
                                       self.display_song_album_art_callback,
-                                      entry)
+                                      (self._cover_generation, cache_key))
+            return
 
-    def _inline_progress_label(self, entry):
+        self._display_song_album_art_rendered(renders, cache_key, filename,
+                                              scale)
 
-        if (entry is None):
+    def _on_cover_scale_changed(self, *args):
+        """
+           the album-art has moved to a display with a different scale -
+           everything rendered so far is the wrong size
+        """
+        self._cover_cache.clear()
+
+        if self.entry is not None and self._song_label_content is not None:
+            self._cancel_cover_requests()
+            self._request_cover(
+                self.entry.create_ext_db_key(RB.RhythmDBPropType.ALBUM))
+
+    def _cover_atlas(self, scale):
+        """
+           the thumbnail atlas for a display scale factor
+        """
+        if scale not in self._cover_atlases:
+            filename = RB.user_cache_dir() + \
+                "/alternate-toolbar/cover_thumbnails"
+            if scale != 1:
+                filename += "@{0}x".format(scale)
+
+            self._cover_atlases[scale] = ThumbnailAtlas(
+                filename, cover_size * scale, cover_size * scale)
+
+        return self._cover_atlases[scale]
+
+    @staticmethod
+    def _cover_render_sizes(scale):
+        """
+           pixel sizes of the thumbnail and popover renders for a display
+           scale factor
+        """
+        return [(cover_size * scale, cover_size * scale),
+                (popover_cover_size * scale, popover_cover_size * scale)]
+
+    def _cover_surfaces(self, renders, scale):
+        """
+           convert CoverArtLoader renders to cairo surfaces - done once per
+           size so that GTK does not convert the pixbuf on every draw
+           :param renders: dict of (width, height) to GdkPixbuf
+           :param scale: display scale factor the renders were made for
+           :return: dict of logical size to cairo.ImageSurface
+        """
+        covers = {}
+        window = self.album_cover.get_window()
+
+        for size in (cover_size, popover_cover_size):
+            pixbuf = renders.get((size * scale, size * scale))
+            if pixbuf is not None:
+                covers[size] = Gdk.cairo_surface_create_from_pixbuf(pixbuf,
+                                                                    scale,
+                                                                    window)
+
+        return covers
+
+    def _lookup_cover(self, key):
+        """
+           filename of the art stored for the ExtDB key without loading it
+           :param key: RBExtDBKey
+           :return: filename or None
+        """
+        ret = self.album_art_db.lookup(key)
+
+        # rhythmbox 3.1 added the store_key out parameter
+        if isinstance(ret, tuple):
+            ret = ret[0]
+
+        return ret
+
+    @staticmethod
+    def _cover_mtime(filename):
+        """
+           modification time of the art used to validate stored thumbnails
+           :return: int or None if the file does not exist
+        """
+        if not filename:
+            return None
+
+        try:
+            return int(os.path.getmtime(filename))
+        except OSError:
+            return None
+
+    def _cover_popover_rendered(self, renders, covers, cache_key, scale):
+        """
+           CoverArtLoader callback with the popover render of art whose
+           thumbnail came from the thumbnail atlas
+        """
+        covers.update(self._cover_surfaces(renders, scale))
+        self._cover_cache.put(cache_key, covers)
+        self._display_cover(covers)
+
+        size = popover_cover_size * scale
+        self._request_accent(cache_key, pixbuf=renders.get((size, size)))
+
+    def _cache_cover_renders(self, renders, cache_key, filename, scale):
+        """
+           remember album-art renders as surfaces in the memory cache and,
+           when the art filename is known, the thumbnail in the thumbnail
+           atlas
+           :return: dict of logical size to cairo.ImageSurface
+        """
+        covers = self._cover_surfaces(renders, scale)
+
+        if cover_size not in covers:
+            return covers
+
+        self._cover_cache.put(cache_key, covers)
+
+        mtime = self._cover_mtime(filename)
+        if mtime is not None:
+            size = cover_size * scale
+            self._cover_atlas(scale).put(cache_key, mtime,
+                                         renders[(size, size)])
+
+        return covers
+
+    def _request_accent(self, cache_key, pixbuf=None, covers=None):
+        """
+           tint the toolbar with the dominant colour of the album-art - from
+           the colour cache or else extracted on a worker thread
+           :param cache_key: ExtDB key string of the album-art
+           :param pixbuf: GdkPixbuf render of the album-art
+           :param covers: dict of album-art surfaces - used when no pixbuf
+           is to hand
+        """
+        if not self._accent:
+            return
+
+        if cache_key in self._accent_cache:
+            self._apply_accent(self._accent_cache.get(cache_key))
+            return
+
+        if pixbuf is None and covers:
+            # the thumbnail is small enough to convert on the main thread
+            surface = covers.get(cover_size)
+            if surface is not None:
+                pixbuf = Gdk.pixbuf_get_from_surface(
+                    surface, 0, 0, surface.get_width(),
+                    surface.get_height())
+
+        if pixbuf is None:
+            return
+
+        self._cover_loader.accent_colour(pixbuf, self._accent_extracted,
+                                         cache_key, group='cover')
+
+    def _accent_extracted(self, colour, cache_key):
+        """
+           CoverArtLoader callback with the dominant album-art colour
+        """
+        self._accent_cache.put(cache_key, colour)
+
+        if cache_key == self._cover_key:
+            self._apply_accent(colour)
+
+    def _apply_accent(self, colour):
+        """
+           reload the accent CSS provider - nothing is restyled when the
+           colour has not changed
+           :param colour: (red, green, blue) tuple or None for no tint
+        """
+        if self._accent_provider is None or colour == self._accent_colour:
+            return
+
+        self._accent_colour = colour
+
+        css = ''
+        if colour is not None:
+            css = accent_css.format('rgb({0},{1},{2})'.format(*colour))
+
+        self._accent_provider.load_from_data(css.encode())
+
+    @staticmethod
+    def _covers_size(covers):
+        """
+           size in bytes of a dict of album-art surfaces
+        """
+        return sum(surface.get_stride() * surface.get_height()
+                   for surface in covers.values())
+
+    def _on_album_art_added(self, db, key, filename, data):
+        """
+           RBExtDB added signal - forget the renders of replaced art
+        """
+        self._cover_cache.remove(key.to_string())
+
+    def _inline_progress_label(self, content):
+        """
+           display the title and artist labels before the progress bar
+           :param content: tuple of title and artist markup or None
+        """
+
+        if content is None:
             # self.song_button_label.set_text("")
             self.inline_box.set_visible(False)
-            return False
+            return
 
         self.inline_box.set_visible(True)
 
+        title, artist = content
+
+        for child in self.inline_box:
+            self.inline_box.remove(child)
+
+        self.song_title = Gtk.Label()
+        self.song_title.set_markup(title)
+        self.song_title.set_ellipsize(Pango.EllipsizeMode.END)
+        self.song_title.show()
+        self.inline_box.pack_start(self.song_title, False, True, 0)
+        print(artist)
+        if artist:
+            print("adding artist")
+            self.song_artist = Gtk.Label()
+            self.song_artist.set_markup(artist)
+            self.song_artist.set_ellipsize(Pango.EllipsizeMode.END)
+            self.song_artist.show()
+            self.inline_box.pack_start(self.song_artist, False, True, 1)
+
+    def _song_label_markup(self, entry):
+        """
+           return the now-playing markup for the entry - rendered markup is
+           cached against the entry, the properties displayed and the label
+           settings so that repeated displays of a track are free
+           :param RBEntry
+           :return: markup as calculated by _inline_progress_markup or
+           _combined_progress_markup, None if there is no entry
+        """
+
+        if (entry is None):
+            return None
+
         db = self.shell.props.db
         stream_title = \
             db.entry_request_extra_metadata(entry,
@@ -959,23 +1585,36 @@ class AltToolbarShared(AltToolbarBase):
             db.entry_request_extra_metadata(entry,
                                             RB.RHYTHMDB_PROP_STREAM_SONG_ARTIST)
 
-        def set_labels(title, artist):
-            for child in self.inline_box:
-                self.inline_box.remove(child)
-
-            self.song_title = Gtk.Label()
-            self.song_title.set_markup(title)
-            self.song_title.set_ellipsize(Pango.EllipsizeMode.END)
-            self.song_title.show()
-            self.inline_box.pack_start(self.song_title, False, True, 0)
-            print(artist)
-            if artist != "" or artist:
-                print("adding artist")
-                self.song_artist = Gtk.Label()
-                self.song_artist.set_markup(artist)
-                self.song_artist.set_ellipsize(Pango.EllipsizeMode.END)
-                self.song_artist.show()
-                self.inline_box.pack_start(self.song_artist, False, True, 1)
+        props = (stream_title,
+                 stream_artist,
+                 entry.get_string(RB.RhythmDBPropType.TITLE),
+                 entry.get_string(RB.RhythmDBPropType.ARTIST),
+                 entry.get_string(RB.RhythmDBPropType.ALBUM),
+                 entry.get_string(RB.RhythmDBPropType.GENRE),
+                 entry.get_ulong(RB.RhythmDBPropType.DATE))
+
+        key = (entry.get_ulong(RB.RhythmDBPropType.ENTRY_ID),
+               self.plugin.inline_label,
+               self.plugin.playing_label) + props
+
+        content = self._markup_cache.get(key)
+        if content is None:
+            if self.plugin.inline_label:
+                content = self._inline_progress_markup(*props)
+            else:
+                content = self._combined_progress_markup(*props)
+
+            self._markup_cache.put(key, content)
+
+        return content
+
+    def _inline_progress_markup(self, stream_title, stream_artist, title,
+                                artist, album, genre, year):
+        """
+           utility function to calculate the title and artist markup to be
+           used when the label is displayed before the progress bar
+           :return: tuple of title and artist markup
+        """
 
         if stream_title:
             print("stream_title")
@@ -988,78 +1627,61 @@ class AltToolbarShared(AltToolbarBase):
             title_markup = "<b>{title}</b>".format(
                 title=GLib.markup_escape_text(stream_title))
 
-            set_labels(title_markup, artist_markup)
-
-            return True
+            return title_markup, artist_markup
 
-        album = entry.get_string(RB.RhythmDBPropType.ALBUM)
         if not album or album == "":
             print("album")
             title_markup = "<b>{title}</b>".format(
-                title=GLib.markup_escape_text(
-                    entry.get_string(RB.RhythmDBPropType.TITLE)))
+                title=GLib.markup_escape_text(title))
 
-            artist = entry.get_string(RB.RhythmDBPropType.ARTIST)
             if artist and artist != "":
                 artist_markup = "<small>{artist}</small>".format(
-                    artist=GLib.markup_escape_text(
-                        entry.get_string(RB.RhythmDBPropType.ARTIST)))
+                    artist=GLib.markup_escape_text(artist))
             else:
                 artist_markup = ""
 
-            set_labels(title_markup, artist_markup)
-
-            return True
+            return title_markup, artist_markup
 
         if self.plugin.playing_label:
             print("playing_label")
-            year = entry.get_ulong(RB.RhythmDBPropType.DATE)
             if year == 0:
                 year = date.today().year
             else:
                 year = datetime.fromordinal(year).year
 
             title_markup = "<b>{album}</b>".format(
-                album=GLib.markup_escape_text(
-                    entry.get_string(RB.RhythmDBPropType.ALBUM)))
+                album=GLib.markup_escape_text(album))
             artist_markup = "<small>{genre} - {year}</small>".format(
-                genre=GLib.markup_escape_text(
-                    entry.get_string(RB.RhythmDBPropType.GENRE)),
+                genre=GLib.markup_escape_text(genre),
                 year=GLib.markup_escape_text(str(year)))
-
-            set_labels(title_markup, artist_markup)
         else:
             print("not playing_label")
             title_markup = "<b>{title}</b>".format(
-                title=GLib.markup_escape_text(
-                    entry.get_string(RB.RhythmDBPropType.TITLE)))
+                title=GLib.markup_escape_text(title))
 
             artist_markup = "<small>{artist}</small>".format(
-                artist=GLib.markup_escape_text(
-                    entry.get_string(RB.RhythmDBPropType.ARTIST)))
+                artist=GLib.markup_escape_text(artist))
 
-            set_labels(title_markup, artist_markup)
+        return title_markup, artist_markup
 
-        return True
-
-    def _combined_progress_label(self, entry):
+    def _combined_progress_label(self, content):
         """
-           utility function to calculate the label to be used when a progress
-           bar has the label above it
-           :param RBEntry
+           display the label above the progress bar
+           :param content: markup string or None
         """
 
-        if (entry is None):
+        if content is None:
             self.song_button_label.set_label("")
-            return False
+        else:
+            self.song_button_label.set_markup(content)
 
-        db = self.shell.props.db
-        stream_title = \
-            db.entry_request_extra_metadata(entry,
-                                            RB.RHYTHMDB_PROP_STREAM_SONG_TITLE)
-        stream_artist = \
-            db.entry_request_extra_metadata(entry,
-                                            RB.RHYTHMDB_PROP_STREAM_SONG_ARTIST)
+    def _combined_progress_markup(self, stream_title, stream_artist, title,
+                                  artist, album, genre, year):
+        """
+           utility function to calculate the label to be used when a progress
+           bar has the label above it
+           :return: markup string
+        """
 
         if stream_title:
             if stream_artist:
@@ -1069,65 +1691,94 @@ class AltToolbarShared(AltToolbarBase):
             else:
                 markup = "<small><b>{title}</b></small>".format(
                     title=GLib.markup_escape_text(stream_title))
-            self.song_button_label.set_markup(markup)
-            return True
+            return markup
 
-        album = entry.get_string(RB.RhythmDBPropType.ALBUM)
         if not album or album == "":
-            self.song_button_label.set_markup(
-                "<small><b>{title}</b></small>".format(
-                    title=GLib.markup_escape_text(
-                        entry.get_string(RB.RhythmDBPropType.TITLE))))
-            return True
+            return "<small><b>{title}</b></small>".format(
+                title=GLib.markup_escape_text(title))
 
         if self.plugin.playing_label:
-            year = entry.get_ulong(RB.RhythmDBPropType.DATE)
             if year == 0:
                 year = date.today().year
             else:
                 year = datetime.fromordinal(year).year
 
-            self.song_button_label.set_markup(
-                "<small>{album} - {genre} - {year}</small>".format(
-                    album=GLib.markup_escape_text(
-                        entry.get_string(RB.RhythmDBPropType.ALBUM)),
-                    genre=GLib.markup_escape_text(
-                        entry.get_string(RB.RhythmDBPropType.GENRE)),
-                    year=GLib.markup_escape_text(str(year))))
+            markup = "<small>{album} - {genre} - {year}</small>".format(
+                album=GLib.markup_escape_text(album),
+                genre=GLib.markup_escape_text(genre),
+                year=GLib.markup_escape_text(str(year)))
         else:
-            self.song_button_label.set_markup(
-                "<small><b>{title}</b> {album} - {artist}</small>".format(
-                    title=GLib.markup_escape_text(
-                        entry.get_string(RB.RhythmDBPropType.TITLE)),
-                    album=GLib.markup_escape_text(
-                        entry.get_string(RB.RhythmDBPropType.ALBUM)),
-                    artist=GLib.markup_escape_text(
-                        entry.get_string(RB.RhythmDBPropType.ARTIST))))
+            markup = "<small><b>{title}</b> {album} - {artist}</small>".format(
+                title=GLib.markup_escape_text(title),
+                album=GLib.markup_escape_text(album),
+                artist=GLib.markup_escape_text(artist))
 
-        return True
+        return markup
 
     def display_song_album_art_callback(self, *args):
         # key, filename, data, entry):
         """
-          RBExtDB signal callback to display the album-art
+          RBExtDB signal callback to display the album-art - the art is
+          decoded and scaled on a worker thread
         """
         # rhythmbox 3.2 breaks the API - need to find the parameter with the
-        # pixbuf
+        # pixbuf. The last parameter is always our request generation and
+        # cache key
+        generation, cache_key = args[-1]
+        if generation != self._cover_generation:
+            # superseded by a newer song change - nothing to decode
+            return
+
         data = None
-        for data in args:
-            if isinstance(data, GdkPixbuf.Pixbuf):
-                break
+        filename = None
+        for arg in args[:-1]:
+            if isinstance(arg, GdkPixbuf.Pixbuf):
+                data = arg
+            elif isinstance(arg, str):
+                filename = arg
+
+        if data is None:
+            self._display_cover({})
+            return
+
+        scale = self.album_cover.get_scale_factor()
+        self._cover_loader.load(filename, data,
+                                self._cover_render_sizes(scale),
+                                self._display_song_album_art_rendered,
+                                cache_key, filename, scale, group='cover')
+
+    def _display_song_album_art_rendered(self, renders, cache_key, filename,
+                                         scale):
+        """
+          CoverArtLoader callback with the scaled album-art
+          :param renders: dict of (width, height) to GdkPixbuf
+          :param cache_key: memory cache key to remember the renders against
+          :param filename: art filename - used to store the thumbnail in the
+          thumbnail atlas
+          :param scale: display scale factor the renders were made for
+        """
+        self._display_cover(self._cache_cover_renders(renders, cache_key,
+                                                      filename, scale))
+
+        size = popover_cover_size * scale
+        self._request_accent(cache_key, pixbuf=renders.get((size, size)))
 
-        if ((data is not None) and (isinstance(data, GdkPixbuf.Pixbuf))):
-            self.cover_pixbuf = data
-            scale_cover = \
-                self.cover_pixbuf.scale_simple(34, 34,
-                                               GdkPixbuf.InterpType.HYPER)
+    def _display_cover(self, covers):
+        """
+          display album-art surfaces on the toolbar and in the cover popover
+          :param covers: dict of logical size to cairo.ImageSurface - empty
+          when there is no album-art
+        """
+        thumbnail = covers.get(cover_size)
 
-            self.album_cover.set_from_pixbuf(scale_cover)
+        if thumbnail is not None:
+            # only the popover sized render is kept - never the original
+            self.cover_surface = covers.get(popover_cover_size)
+            self.album_cover.set_from_surface(thumbnail)
         else:
-            self.cover_pixbuf = None
+            self.cover_surface = None
             self.album_cover.clear()
+            self._apply_accent(None)
 
         self.album_cover.trigger_tooltip_query()
 